@@ -2,28 +2,44 @@ from __future__ import annotations
 
 import asyncio
 import csv
-import sqlite3
+import os
 from pathlib import Path
-from typing import Annotated, Optional
+from typing import Annotated, Any, Coroutine, Optional, TypeVar
 
 import typer
-import uvicorn
 from rich.console import Console
 from rich.table import Table
 
-from .db import Database
-from .fetch import detect_source, fetch_html
-from .parse import extract_price
-from .runner import poll_all, run_forever
+from .db import OBSERVATION_COLUMNS, Database
+from .fetch import aclose, detect_source, fetch_html
+from .parse import ParsedPrice, extract_price
+from .runner import Admission, HostLimiter, poll_all, run_forever
 from .search import SearchHit, search_products
 from .settings import Settings
-from .tui import PriceTuiApp
-from .web import create_app
 
 
 app = typer.Typer(add_completion=False, help="Track electronics prices (x-kom, morele.net, Amazon) with SQLite + TUI.")
 console = Console()
 
+T = TypeVar("T")
+
+
+def _run(coro: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine to completion, on uvloop when it is installed."""
+
+    async def main() -> T:
+        try:
+            return await coro
+        finally:
+            # The shared browser lives on this loop; shut it down before the loop closes.
+            await aclose()
+
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(main())
+    return uvloop.run(main())
+
 
 def _db_from_option(db: Path | None) -> Database:
     settings = Settings()
@@ -50,14 +66,10 @@ def _insert_product_and_observation(
     error: str | None,
 ) -> int | None:
     product_name = name_hint or title or url
-    try:
-        pid = database.add_product(product_name, url, source)
-    except sqlite3.IntegrityError:
-        console.print(f"[yellow]Skip (already exists): {url}")
-        return None
-
-    database.add_observation(
-        pid,
+    pid = database.add_product_with_observation(
+        product_name,
+        url,
+        source,
         price_cents=price_cents,
         currency=currency,
         in_stock=in_stock,
@@ -65,6 +77,8 @@ def _insert_product_and_observation(
         raw_price_text=raw_price_text,
         error=error,
     )
+    if pid is None:
+        console.print(f"[yellow]Skip (already exists): {url}")
     return pid
 
 
@@ -89,7 +103,7 @@ def add(
     database.init()
 
     source = detect_source(url)
-    parsed = asyncio.run(_fetch_and_parse(url, source))
+    parsed = _run(_fetch_and_parse(url, source))
     pid = _insert_product_and_observation(
         database,
         url=url,
@@ -148,6 +162,7 @@ def add_search(
     search: Annotated[str, typer.Option("--search", "-q", help="Search phrase")],
     top: Annotated[int, typer.Option("--top", "-n", help="Number of results to add")] = 10,
     concurrency: Annotated[int, typer.Option(help="Concurrent fetches for product pages")] = 5,
+    per_host: Annotated[int, typer.Option(help="Max concurrent fetches per store")] = 8,
     db: Annotated[Optional[Path], typer.Option(help="Path to SQLite database file")] = None,
 ) -> None:
     """Search the store, take top N results, add them, and record initial observations."""
@@ -155,46 +170,60 @@ def add_search(
     database = _db_from_option(db)
     database.init()
 
-    try:
-        hits = asyncio.run(search_products(store, search, limit=top))
-    except ValueError as e:
-        raise typer.Exit(code=1, message=str(e))
-
-    if not hits:
-        console.print("[yellow]No results found")
-        return
-
-    console.print(f"Found {len(hits)} result(s); fetching product pages...")
+    async def _search_and_fetch() -> list[tuple[SearchHit, ParsedPrice]]:
+        hits = await search_products(store, search, limit=top)
+        if not hits:
+            return []
 
-    async def _process(hits_in: list[SearchHit]):
-        sem = asyncio.Semaphore(concurrency)
+        console.print(f"Found {len(hits)} result(s); fetching product pages...")
+        admission = Admission(concurrency)
+        hosts = HostLimiter(per_host)
 
         async def one(hit: SearchHit):
-            async with sem:
+            # Take the per-store slot first so a busy store does not hold
+            # global slots that other stores could use.
+            async with hosts.slot(hit.source), admission.slot():
                 parsed = await _fetch_and_parse(hit.url, hit.source)
                 return hit, parsed
 
-        return await asyncio.gather(*[one(h) for h in hits_in])
+        return await asyncio.gather(*[one(h) for h in hits])
 
-    results = asyncio.run(_process(hits))
+    # Search and page fetches share one event loop.
+    try:
+        results = _run(_search_and_fetch())
+    except ValueError as e:
+        console.print(f"[red]{e}")
+        raise typer.Exit(code=1)
+
+    if not results:
+        console.print("[yellow]No results found")
+        return
+
+    # One transaction for the whole batch instead of two commits per hit.
+    pids = database.add_products_with_observations(
+        [
+            {
+                "name": hit.name or parsed.title or hit.url,
+                "url": hit.url,
+                "source": hit.source,
+                "price_cents": parsed.price_cents if parsed.price_cents is not None else hit.price_cents,
+                "currency": parsed.currency if parsed.currency is not None else hit.currency,
+                "in_stock": parsed.in_stock,
+                "title": parsed.title,
+                "raw_price_text": parsed.raw_price_text,
+                "error": parsed.error,
+            }
+            for hit, parsed in results
+        ]
+    )
 
     added = 0
-    for hit, parsed in results:
-        pid = _insert_product_and_observation(
-            database,
-            url=hit.url,
-            source=hit.source,
-            name_hint=hit.name,
-            price_cents=parsed.price_cents if parsed.price_cents is not None else hit.price_cents,
-            currency=parsed.currency if parsed.currency is not None else hit.currency,
-            in_stock=parsed.in_stock,
-            title=parsed.title,
-            raw_price_text=parsed.raw_price_text,
-            error=parsed.error,
-        )
-        if pid:
-            added += 1
-            console.print(f"Added product #{pid}: {hit.name} [{hit.source}]")
+    for (hit, _), pid in zip(results, pids):
+        if pid is None:
+            console.print(f"[yellow]Skip (already exists): {hit.url}")
+            continue
+        added += 1
+        console.print(f"Added product #{pid}: {hit.name} [{hit.source}]")
 
     console.print(f"Done. Added {added}/{len(results)} new products")
 
@@ -202,27 +231,31 @@ def add_search(
 @app.command()
 def once(
     concurrency: Annotated[int, typer.Option(help="Max concurrent requests")] = 6,
+    per_host: Annotated[int, typer.Option(help="Max concurrent fetches per store")] = 3,
     db: Annotated[Optional[Path], typer.Option(help="Path to SQLite database file")] = None,
 ) -> None:
     """Fetch all tracked products once and store observations."""
     database = _db_from_option(db)
     database.init()
-    results = asyncio.run(poll_all(database, concurrency=concurrency))
+    results = _run(poll_all(database, concurrency=concurrency, per_host=per_host))
     ok = sum(1 for r in results if r.ok)
     console.print(f"Done. OK: {ok}/{len(results)}")
 
 
 @app.command()
 def run(
-    interval: Annotated[int, typer.Option(help="Polling interval in seconds")] = 900,
+    interval: Annotated[
+        int, typer.Option(help="Base polling interval in seconds; unchanged products back off up to 8x")
+    ] = 900,
     concurrency: Annotated[int, typer.Option(help="Max concurrent requests")] = 6,
+    per_host: Annotated[int, typer.Option(help="Max concurrent fetches per store")] = 3,
     db: Annotated[Optional[Path], typer.Option(help="Path to SQLite database file")] = None,
 ) -> None:
     """Run periodic polling forever."""
     database = _db_from_option(db)
     database.init()
     console.print(f"Polling every {interval}s. DB: {database.path}")
-    asyncio.run(run_forever(database, interval_s=interval, concurrency=concurrency))
+    _run(run_forever(database, interval_s=interval, concurrency=concurrency, per_host=per_host))
 
 
 @app.command()
@@ -232,6 +265,9 @@ def tui(
     """Open the Textual TUI to browse products and price history."""
     database = _db_from_option(db)
     database.init()
+
+    from .tui import PriceTuiApp
+
     PriceTuiApp(database.path).run()
 
 
@@ -244,37 +280,12 @@ def export(
     database = _db_from_option(db)
     database.init()
 
-    rows = database.iter_observations()
     out.parent.mkdir(parents=True, exist_ok=True)
     with out.open("w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
-        writer.writerow(
-            [
-                "id",
-                "product_id",
-                "ts",
-                "price_cents",
-                "currency",
-                "in_stock",
-                "title",
-                "raw_price_text",
-                "error",
-            ]
-        )
-        for r in rows:
-            writer.writerow(
-                [
-                    r["id"],
-                    r["product_id"],
-                    r["ts"],
-                    r["price_cents"],
-                    r["currency"],
-                    r["in_stock"],
-                    r["title"],
-                    r["raw_price_text"],
-                    r["error"],
-                ]
-            )
+        writer.writerow(OBSERVATION_COLUMNS)
+        # Rows arrive as tuples in header order; writerows loops in C.
+        writer.writerows(database.iter_observations())
 
     console.print(f"Wrote: {out}")
 
@@ -283,6 +294,7 @@ def export(
 def clear(
     db: Annotated[Optional[Path], typer.Option(help="Path to SQLite database file")] = None,
     yes: Annotated[bool, typer.Option("--yes", "-y", help="Skip confirmation")] = False,
+    vacuum: Annotated[bool, typer.Option(help="Compact the database file afterwards")] = False,
 ) -> None:
     """Delete all products and observations from the database."""
     database = _db_from_option(db)
@@ -297,10 +309,7 @@ def clear(
             console.print("Aborted")
             raise typer.Exit(code=1)
 
-    with database.connect() as conn:
-        conn.execute("DELETE FROM observations")
-        conn.execute("DELETE FROM products")
-        conn.commit()
+    database.clear(vacuum=vacuum)
     console.print("Database cleared.")
 
 
@@ -309,10 +318,27 @@ def serve(
     host: Annotated[str, typer.Option(help="Bind host")] = "127.0.0.1",
     port: Annotated[int, typer.Option(help="Bind port")] = 8000,
     db: Annotated[Optional[Path], typer.Option(help="Path to SQLite database file")] = None,
+    workers: Annotated[int, typer.Option(min=1, help="Number of worker processes")] = 1,
 ) -> None:
     """Start the web UI for managing tracked items."""
 
+    import uvicorn
+
+    from .web import create_app
+
     database = _db_from_option(db)
     database.init()
-    app = create_app(database.path)
-    uvicorn.run(app, host=host, port=port, log_level="info")
+    if workers == 1:
+        uvicorn.run(create_app(database.path), host=host, port=port, log_level="info")
+        return
+
+    # Worker processes build their own app from the factory and find the DB via env.
+    os.environ["ELPC_DB"] = str(database.path)
+    uvicorn.run(
+        "el_price_checker.web:create_app_factory",
+        factory=True,
+        host=host,
+        port=port,
+        workers=workers,
+        log_level="info",
+    )
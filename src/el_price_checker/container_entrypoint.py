@@ -5,16 +5,28 @@ from pathlib import Path
 
 import uvicorn
 
-from .web import create_app
+from .db import Database
 
 
 def main() -> None:
     host = os.getenv("ELPC_WEB_HOST", "0.0.0.0")
     port = int(os.getenv("ELPC_WEB_PORT", "8000"))
     db_path = Path(os.getenv("ELPC_DB", "/data/prices.sqlite3"))
-
-    app = create_app(db_path)
-    uvicorn.run(app, host=host, port=port, log_level="info")
+    workers = int(os.getenv("ELPC_WEB_WORKERS", str(os.cpu_count() or 1)))
+    log_level = os.getenv("ELPC_WEB_LOG_LEVEL", "warning")
+
+    # Migrate once here so the workers don't race each other on startup.
+    Database(db_path).init()
+    os.environ["ELPC_DB"] = str(db_path)
+
+    uvicorn.run(
+        "el_price_checker.web:create_app_factory",
+        factory=True,
+        host=host,
+        port=port,
+        workers=workers,
+        log_level=log_level,
+    )
 
 
 if __name__ == "__main__":
@@ -1,16 +1,255 @@
 from __future__ import annotations
 
+import json
+import re
 import sqlite3
+import statistics
+import threading
 import time
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable
-
-
-SCHEMA_VERSION = 3
-
-
-@dataclass(frozen=True)
+from typing import Any, Iterable, Iterator
+
+
+SCHEMA_VERSION = 10
+
+# Hot statements live at module level so every call hands sqlite3 the same
+# string object and hits its per-connection statement cache.
+OBSERVATION_COLUMNS = (
+    "id",
+    "product_id",
+    "ts",
+    "price_cents",
+    "currency",
+    "in_stock",
+    "title",
+    "raw_price_text",
+    "error",
+)
+_OBSERVATION_COLUMNS = ", ".join(OBSERVATION_COLUMNS)
+
+_PRODUCT_COLUMNS = "id, name, url, source, created_at, display_order"
+
+_PRODUCTS_SQL = f"SELECT {_PRODUCT_COLUMNS} FROM products ORDER BY display_order, id"
+
+_PRODUCT_SQL = f"SELECT {_PRODUCT_COLUMNS} FROM products WHERE id = ?"
+
+_PRODUCT_BY_URL_SQL = f"SELECT {_PRODUCT_COLUMNS} FROM products WHERE url = ?"
+
+# URL lists travel as one JSON array, like the id lists below, so the
+# statement text never changes and no list can exceed the bound-variable limit.
+_PRODUCT_URLS_FOR_SQL = "SELECT url FROM products WHERE url IN (SELECT value FROM json_each(?))"
+
+_PRODUCT_IDS_FOR_URLS_SQL = (
+    "SELECT id, url FROM products WHERE url IN (SELECT value FROM json_each(?))"
+)
+
+_NEXT_DISPLAY_ORDER_SQL = "SELECT COALESCE(MAX(display_order), 0) + 1 FROM products"
+
+_INSERT_PRODUCT_SQL = """
+INSERT INTO products(name, url, source, created_at, display_order)
+VALUES (
+  ?, ?, ?,
+  CAST(strftime('%s', 'now') AS INTEGER),
+  (SELECT COALESCE(MAX(display_order), 0) + 1 FROM products)
+)
+ON CONFLICT(url) DO NOTHING
+RETURNING id
+"""
+
+# Positions come from the JSON array index, so the whole reorder is one statement.
+_SET_PRODUCT_ORDER_SQL = """
+UPDATE products
+SET display_order = o.pos
+FROM (SELECT value AS id, key + 1 AS pos FROM json_each(?)) AS o
+WHERE products.id = o.id
+"""
+
+_RENAME_PRODUCT_SQL = "UPDATE products SET name = ? WHERE id = ?"
+
+_ATTACH_TAG_SQL = """
+INSERT INTO product_tags(product_id, tag_id) VALUES (?, ?)
+ON CONFLICT DO NOTHING
+RETURNING tag_id
+"""
+
+_INSERT_OBSERVATION_SQL = """
+INSERT INTO observations(product_id, ts, price_cents, currency, in_stock, title, raw_price_text, error)
+VALUES (?, COALESCE(?, CAST(strftime('%s', 'now') AS INTEGER)), ?, ?, ?, ?, ?, ?)
+"""
+
+_HISTORY_SQL = f"""
+SELECT {_OBSERVATION_COLUMNS}
+FROM observations
+WHERE product_id = ?
+ORDER BY ts DESC, id DESC
+LIMIT ?
+"""
+
+# The same window oldest-first; re-sorting the few kept rows in SQLite is cheaper
+# than reversing Observation objects in Python.
+_HISTORY_ASC_SQL = f"""
+SELECT {_OBSERVATION_COLUMNS}
+FROM ({_HISTORY_SQL})
+ORDER BY ts, id
+"""
+
+_LATEST_OBSERVATIONS_SQL = """
+SELECT o.id, o.product_id, o.ts, o.price_cents, o.currency, o.in_stock, o.title, o.raw_price_text, o.error
+FROM products p
+JOIN observations o ON o.id = (
+  SELECT id
+  FROM observations
+  WHERE product_id = p.id
+  ORDER BY ts DESC, id DESC
+  LIMIT 1
+)
+"""
+
+# One row per product for the dashboard, with display projections (price in
+# units, currency fallback, local timestamp) evaluated by SQLite. The change is
+# against the last priced observation at or before :cutoff, in the same
+# currency; the probe only runs for priced products and is one index seek.
+_DASHBOARD_SQL = """
+SELECT
+  p.id, p.name, p.source, p.url,
+  o.price_cents,
+  o.price_cents / 100.0,
+  COALESCE(o.currency, ''),
+  COALESCE(strftime('%Y-%m-%d %H:%M', o.ts, 'unixepoch', 'localtime'), ''),
+  o.error,
+  CASE WHEN prev.currency IS o.currency THEN (o.price_cents - prev.price_cents) / 100.0 END
+FROM products p
+LEFT JOIN observations o ON o.id = (
+  SELECT id
+  FROM observations
+  WHERE product_id = p.id
+  ORDER BY ts DESC, id DESC
+  LIMIT 1
+)
+LEFT JOIN observations prev ON o.price_cents IS NOT NULL AND prev.id = (
+  SELECT id
+  FROM observations
+  WHERE product_id = p.id AND price_cents IS NOT NULL AND ts <= :cutoff
+  ORDER BY ts DESC
+  LIMIT 1
+)
+ORDER BY p.display_order, p.id
+"""
+
+_PRICED_AT_OR_BEFORE_SQL = f"""
+SELECT {_OBSERVATION_COLUMNS}
+FROM observations
+WHERE product_id = ?
+  AND ts <= ?
+  AND price_cents IS NOT NULL
+ORDER BY ts DESC
+LIMIT 1
+"""
+
+_HEX_COLOR_MATCH = re.compile(r"#[0-9A-F]{6}").fullmatch
+
+# Insert-time outlier screening compares against the median of this many
+# recent priced observations.
+_OUTLIER_SAMPLE_LIMIT = 50
+
+# init() re-runs the full outlier sweep at most this often; insert-time
+# screening keeps new data clean in between.
+CLEAN_INTERVAL_S = 7 * 86400
+
+_OUTLIER_SAMPLES_SQL = """
+SELECT price_cents
+FROM observations
+WHERE product_id = ? AND price_cents IS NOT NULL
+ORDER BY ts DESC
+LIMIT ?
+"""
+
+_OUTLIER_SAMPLES_FOR_SQL = """
+SELECT j.value, (
+  SELECT group_concat(price_cents)
+  FROM (
+    SELECT price_cents
+    FROM observations
+    WHERE product_id = j.value AND price_cents IS NOT NULL
+    ORDER BY ts DESC
+    LIMIT ?
+  )
+)
+FROM json_each(?) AS j
+"""
+
+# Per product: take the latest :sample_limit priced rows, find their median
+# (mean of the one or two middle values) and delete those rows that sit more
+# than :factor times away from it. The CTE lives inside the IN (...) so the
+# statement starts with DELETE and sqlite3 reports rowcount.
+_DELETE_OUTLIERS_SQL = """
+DELETE FROM observations
+WHERE id IN (
+  WITH recent AS (
+    SELECT id, product_id, price_cents,
+           ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY ts DESC) AS rn
+    FROM observations
+    WHERE price_cents IS NOT NULL
+  ),
+  sample AS (
+    SELECT id, product_id, price_cents,
+           ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY price_cents) AS pos,
+           COUNT(*) OVER (PARTITION BY product_id) AS n
+    FROM recent
+    WHERE rn <= :sample_limit
+  ),
+  medians AS (
+    SELECT product_id, AVG(price_cents) AS med
+    FROM sample
+    WHERE n >= :min_samples AND pos IN ((n + 1) / 2, (n + 2) / 2)
+    GROUP BY product_id
+  )
+  SELECT s.id
+  FROM sample s
+  JOIN medians m ON m.product_id = s.product_id
+  WHERE m.med > 0
+    AND (s.price_cents < m.med / :factor OR s.price_cents > m.med * :factor)
+)
+"""
+
+_ITER_OBSERVATIONS_SQL = (
+    f"SELECT {_OBSERVATION_COLUMNS} FROM observations ORDER BY ts DESC"
+)
+
+# Id lists travel as one JSON array parameter so the statement text (and its
+# cached prepared statement) doesn't change with the number of ids.
+_ITER_OBSERVATIONS_FOR_SQL = (
+    f"SELECT {_OBSERVATION_COLUMNS} FROM observations"
+    " WHERE product_id IN (SELECT value FROM json_each(?)) ORDER BY ts DESC"
+)
+
+_PAGE_CACHE_COLUMNS = (
+    "product_id, etag, last_modified, price_cents, currency, in_stock, title, raw_price_text"
+)
+
+_PAGE_CACHE_FOR_SQL = f"""
+SELECT {_PAGE_CACHE_COLUMNS}
+FROM page_cache
+WHERE product_id IN (SELECT value FROM json_each(?))
+"""
+
+_UPSERT_PAGE_CACHE_SQL = f"""
+INSERT OR REPLACE INTO page_cache({_PAGE_CACHE_COLUMNS})
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_TAGS_FOR_PRODUCTS_SQL = """
+SELECT pt.product_id, t.id, t.name, t.color
+FROM product_tags pt
+JOIN tags t ON t.id = pt.tag_id
+WHERE pt.product_id IN (SELECT value FROM json_each(?))
+ORDER BY t.name
+"""
+
+
+@dataclass(frozen=True, slots=True)
 class Product:
     id: int
     name: str
@@ -20,7 +259,7 @@ class Product:
     display_order: int
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Observation:
     id: int
     product_id: int
@@ -33,27 +272,62 @@ class Observation:
     error: str | None
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Tag:
     id: int
     name: str
     color: str
 
 
+@dataclass(frozen=True, slots=True)
+class DashboardRow:
+    """A product with its latest observation, formatted for display."""
+
+    id: int
+    name: str
+    source: str
+    url: str
+    price_cents: int | None
+    last_price: float | None
+    currency: str
+    last_seen: str
+    error: str | None
+    change: float | None
+
+
+@dataclass(frozen=True, slots=True)
+class PageCache:
+    """HTTP validators of a product page plus what was parsed from that version."""
+
+    product_id: int
+    etag: str | None
+    last_modified: str | None
+    price_cents: int | None
+    currency: str | None
+    in_stock: bool | None
+    title: str | None
+    raw_price_text: str | None
+
+
+def _row_to_observation(r: tuple[Any, ...]) -> Observation:
+    # Rows are in OBSERVATION_COLUMNS order; only in_stock needs converting.
+    return Observation(
+        r[0], r[1], r[2], r[3], r[4], None if r[5] is None else bool(r[5]), r[6], r[7], r[8]
+    )
+
+
 class Database:
     def __init__(self, path: Path):
         self.path = path
+        # One long-lived connection per thread (the web UI serves sync routes
+        # from a threadpool); reusing it keeps SQLite's page cache warm.
+        self._local = threading.local()
+        self._conns: list[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
 
     @staticmethod
     def _median(values: list[int]) -> float:
-        if not values:
-            return 0.0
-        vals = sorted(values)
-        n = len(vals)
-        mid = n // 2
-        if n % 2 == 1:
-            return float(vals[mid])
-        return (vals[mid - 1] + vals[mid]) / 2.0
+        return float(statistics.median(values)) if values else 0.0
 
     @staticmethod
     def _normalize_color(color: str) -> str:
@@ -64,37 +338,108 @@ class Database:
         if not c.startswith("#"):
             c = "#" + c
         if len(c) == 4:  # #RGB -> #RRGGBB
-            c = "#" + "".join([ch * 2 for ch in c[1:]])
-        if len(c) != 7 or any(ch not in "#0123456789ABCDEF" for ch in c):
+            c = f"#{c[1] * 2}{c[2] * 2}{c[3] * 2}"
+        if not _HEX_COLOR_MATCH(c):
             return "#666666"
         return c
 
     def connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.path)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON")
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Each connection stays on its thread; check_same_thread=False only
+            # so close() can shut them all down from the owning thread.
+            conn = sqlite3.connect(
+                self.path, check_same_thread=False, cached_statements=256
+            )
+            self._configure(conn)
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
         return conn
 
+    def close(self) -> None:
+        """Close every connection opened by this Database; later calls reconnect."""
+
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+            self._local = threading.local()
+        for conn in conns:
+            conn.close()
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """Run a write transaction that takes SQLite's write lock up front.
+
+        A deferred transaction that reads first can fail to upgrade to a write
+        lock under WAL if another connection commits in between; BEGIN
+        IMMEDIATE queues on busy_timeout instead and keeps read-then-write
+        methods (next display_order, neighbour swaps) consistent.
+        """
+
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    @staticmethod
+    def _configure(conn: sqlite3.Connection) -> None:
+        # Per-connection settings; journal_mode is persistent and set in init().
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -20000")
+        conn.execute("PRAGMA mmap_size = 268435456")
+        # Wait for the other process (web vs poller) instead of failing with "database is locked".
+        conn.execute("PRAGMA busy_timeout = 5000")
+
     def init(self) -> None:
         self.path.parent.mkdir(parents=True, exist_ok=True)
         with self.connect() as conn:
+            # WAL lets readers (web/TUI) proceed while the poller writes, and
+            # with synchronous=NORMAL commits no longer fsync on every insert.
+            if str(self.path) != ":memory:":
+                conn.execute("PRAGMA journal_mode = WAL")
+
             # Run migrations if needed; always proceed to cleaning.
             current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current > SCHEMA_VERSION:
+                raise RuntimeError(f"Unsupported schema version: {current}")
+            migrated = current < SCHEMA_VERSION
             if current == 0:
                 self._create_v3(conn)
-                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
-            elif current == 1:
-                self._migrate_1_to_2(conn)
-                self._migrate_2_to_3(conn)
-                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
-            elif current == 2:
-                self._migrate_2_to_3(conn)
-                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
-            elif current != SCHEMA_VERSION:
-                raise RuntimeError(f"Unsupported schema version: {current}")
+                current = 3
+            migrations = {
+                1: self._migrate_1_to_2,
+                2: self._migrate_2_to_3,
+                3: self._migrate_3_to_4,
+                4: self._migrate_4_to_5,
+                5: self._migrate_5_to_6,
+                6: self._migrate_6_to_7,
+                7: self._migrate_7_to_8,
+                8: self._migrate_8_to_9,
+                9: self._migrate_9_to_10,
+            }
+            while current < SCHEMA_VERSION:
+                migrations[current](conn)
+                current += 1
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            if migrated:
+                # Fresh statistics so the planner weighs the new indexes correctly.
+                conn.execute("ANALYZE")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'last_clean'").fetchone()
 
         # Clean any pre-existing extreme outliers so future reads use sane baselines.
-        self.clean_price_outliers()
+        if row is None or time.time() - row[0] >= CLEAN_INTERVAL_S:
+            self.clean_price_outliers()
+
+    def maintenance(self) -> None:
+        """Refresh planner statistics that have drifted; cheap when nothing changed."""
+
+        self.connect().execute("PRAGMA optimize")
 
     def _create_v1(self, conn: sqlite3.Connection) -> None:
         conn.executescript(
@@ -188,7 +533,6 @@ class Database:
         cols = {r[1] for r in conn.execute("PRAGMA table_info(tags)").fetchall()}
         if not cols:
             self._create_v3(conn)
-            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             return
 
         conn.executescript(
@@ -210,39 +554,272 @@ class Database:
         )
         conn.commit()
 
-    def add_product(self, name: str, url: str, source: str) -> int:
-        now = int(time.time())
-        with self.connect() as conn:
-            next_order = conn.execute(
-                "SELECT COALESCE(MAX(display_order), 0) + 1 FROM products"
-            ).fetchone()[0]
-            cur = conn.execute(
-                "INSERT INTO products(name, url, source, created_at, display_order) VALUES (?, ?, ?, ?, ?)",
-                (name, url, source, now, int(next_order)),
+    def _migrate_3_to_4(self, conn: sqlite3.Connection) -> None:
+        # History/latest reads walk newest-first; keep the index in that order
+        # with id as tie-breaker so those scans never need a sort step.
+        conn.executescript(
+            """
+            CREATE INDEX IF NOT EXISTS idx_observations_product_ts_desc
+              ON observations(product_id, ts DESC, id DESC);
+
+            DROP INDEX IF EXISTS idx_observations_product_ts;
+            """
+        )
+        conn.commit()
+
+    def _migrate_4_to_5(self, conn: sqlite3.Connection) -> None:
+        # Priced lookups (chart baselines, outlier samples) skip failed polls;
+        # a partial index lets them seek straight past NULL-price rows.
+        conn.executescript(
+            """
+            CREATE INDEX IF NOT EXISTS idx_observations_priced
+              ON observations(product_id, ts DESC)
+              WHERE price_cents IS NOT NULL;
+            """
+        )
+        conn.commit()
+
+    def _migrate_5_to_6(self, conn: sqlite3.Connection) -> None:
+        # Serves MAX(display_order) on insert, the ordered product listing
+        # and move_product's neighbour lookup without scanning products.
+        conn.executescript(
+            """
+            CREATE INDEX IF NOT EXISTS idx_products_display_order
+              ON products(display_order, id);
+            """
+        )
+        conn.commit()
+
+    def _migrate_6_to_7(self, conn: sqlite3.Connection) -> None:
+        # Carry price_cents in the priced index so outlier sampling reads
+        # only the index, never the observation rows.
+        conn.executescript(
+            """
+            DROP INDEX IF EXISTS idx_observations_priced;
+
+            CREATE INDEX idx_observations_priced
+              ON observations(product_id, ts DESC, price_cents)
+              WHERE price_cents IS NOT NULL;
+            """
+        )
+        conn.commit()
+
+    def _migrate_7_to_8(self, conn: sqlite3.Connection) -> None:
+        # Small key/value store for bookkeeping such as the last outlier sweep.
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+              key TEXT PRIMARY KEY,
+              value INTEGER
+            );
+            """
+        )
+        conn.commit()
+
+    def _migrate_8_to_9(self, conn: sqlite3.Connection) -> None:
+        # Conditional GET state: a 304 lets the poller reuse the stored parse.
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS page_cache (
+              product_id INTEGER PRIMARY KEY,
+              etag TEXT,
+              last_modified TEXT,
+              price_cents INTEGER,
+              currency TEXT,
+              in_stock INTEGER,
+              title TEXT,
+              raw_price_text TEXT,
+              FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+            );
+            """
+        )
+        conn.commit()
+
+    def _migrate_9_to_10(self, conn: sqlite3.Connection) -> None:
+        # Per-product polling schedule for run_forever; NULL means "due now".
+        conn.executescript(
+            """
+            ALTER TABLE products ADD COLUMN poll_interval_s INTEGER;
+            ALTER TABLE products ADD COLUMN next_poll_ts INTEGER;
+            """
+        )
+        conn.commit()
+
+    def add_product(self, name: str, url: str, source: str) -> int | None:
+        """Insert a product; returns its id, or None if the URL is already tracked."""
+
+        with self._write() as conn:
+            pid = self._insert_product(conn, name, url, source)
+            return pid
+
+    def add_product_with_observation(
+        self,
+        name: str,
+        url: str,
+        source: str,
+        *,
+        price_cents: int | None = None,
+        currency: str | None = None,
+        in_stock: bool | None = None,
+        title: str | None = None,
+        raw_price_text: str | None = None,
+        error: str | None = None,
+    ) -> int | None:
+        """Insert a product and its first observation in one transaction.
+
+        Returns None (and records nothing) if the URL is already tracked.
+        """
+
+        with self._write() as conn:
+            pid = self._insert_product(conn, name, url, source)
+            if pid is None:
+                return None
+            conn.execute(
+                _INSERT_OBSERVATION_SQL,
+                self._observation_row(
+                    conn,
+                    pid,
+                    ts=None,
+                    recent_prices={},
+                    price_cents=price_cents,
+                    currency=currency,
+                    in_stock=in_stock,
+                    title=title,
+                    raw_price_text=raw_price_text,
+                    error=error,
+                ),
             )
-            pid = int(cur.lastrowid)
-            conn.commit()
             return pid
 
+    def add_products_with_observations(
+        self, items: list[dict[str, Any]]
+    ) -> list[int | None]:
+        """Insert many products plus their first observations in one transaction.
+
+        Each item takes ``name``, ``url`` and ``source`` plus the observation
+        keyword arguments of ``add_product_with_observation``. Returns the new
+        product ids in input order, with None for URLs already tracked.
+        """
+
+        if not items:
+            return []
+        now = int(time.time())
+        with self._write() as conn:
+            urls = [str(item["url"]) for item in items]
+            existing = {
+                r[0] for r in conn.execute(_PRODUCT_URLS_FOR_SQL, (json.dumps(urls),))
+            }
+            next_order = int(
+                conn.execute(_NEXT_DISPLAY_ORDER_SQL).fetchone()[0]
+            )
+
+            new_items: dict[str, dict[str, Any]] = {}
+            for item in items:
+                url = str(item["url"])
+                if url not in existing and url not in new_items:
+                    new_items[url] = item
+            if not new_items:
+                return [None] * len(items)
+
+            conn.executemany(
+                """
+                INSERT INTO products(name, url, source, created_at, display_order)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO NOTHING
+                """,
+                [
+                    (item["name"], url, item["source"], now, next_order + idx)
+                    for idx, (url, item) in enumerate(new_items.items())
+                ],
+            )
+            ids = {
+                r[1]: int(r[0])
+                for r in conn.execute(_PRODUCT_IDS_FOR_URLS_SQL, (json.dumps(list(new_items)),))
+            }
+
+            obs_keys = ("price_cents", "currency", "in_stock", "title", "raw_price_text", "error")
+            conn.executemany(
+                _INSERT_OBSERVATION_SQL,
+                [
+                    self._observation_row(
+                        conn,
+                        ids[url],
+                        ts=now,
+                        recent_prices={},
+                        **{k: item[k] for k in obs_keys if k in item},
+                    )
+                    for url, item in new_items.items()
+                ],
+            )
+
+        out: list[int | None] = []
+        claimed: set[str] = set()
+        for url in urls:
+            if url in new_items and url not in claimed:
+                claimed.add(url)
+                out.append(ids[url])
+            else:
+                out.append(None)
+        return out
+
+    def _insert_product(
+        self, conn: sqlite3.Connection, name: str, url: str, source: str
+    ) -> int | None:
+        row = conn.execute(_INSERT_PRODUCT_SQL, (name, url, source)).fetchone()
+        return None if row is None else int(row[0])
+
+    def revision(self) -> tuple[int, int]:
+        """Token that changes whenever the database may have changed.
+
+        PRAGMA data_version moves when any other connection (another thread or
+        process) commits; total_changes counts this connection's own writes.
+        Tokens are per thread and only meaningful for equality checks.
+        """
+
+        conn = self.connect()
+        return (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+
+    def _read_cache(self) -> dict[Any, Any]:
+        """Per-thread memo of read results, dropped whenever revision() moves."""
+
+        rev = self.revision()
+        cached = getattr(self._local, "reads", None)
+        if cached is None or cached[0] != rev:
+            cached = (rev, {})
+            self._local.reads = cached
+        return cached[1]
+
     def get_products(self) -> list[Product]:
-        with self.connect() as conn:
-            rows = conn.execute(
-                "SELECT id, name, url, source, created_at, display_order FROM products ORDER BY display_order, id"
-            ).fetchall()
-        return [Product(**dict(r)) for r in rows]
+        cache = self._read_cache()
+        products = cache.get("products")
+        if products is None:
+            cur = self.connect().cursor()
+            cur.execute(_PRODUCTS_SQL)
+            products = cache["products"] = tuple(Product(*r) for r in cur)
+        return list(products)
 
     def get_product(self, product_id: int) -> Product | None:
-        with self.connect() as conn:
-            row = conn.execute(
-                "SELECT id, name, url, source, created_at, display_order FROM products WHERE id = ?",
-                (product_id,),
-            ).fetchone()
-        return Product(**dict(row)) if row else None
+        cache = self._read_cache()
+        key = ("product", product_id)
+        if key in cache:
+            return cache[key]
+        cur = self.connect().cursor()
+        row = cur.execute(_PRODUCT_SQL, (product_id,)).fetchone()
+        product = cache[key] = Product(*row) if row else None
+        return product
+
+    def get_product_by_url(self, url: str) -> Product | None:
+        row = self.connect().execute(_PRODUCT_BY_URL_SQL, (url,)).fetchone()
+        return Product(*row) if row else None
 
     def get_all_tags(self) -> list[Tag]:
-        with self.connect() as conn:
-            rows = conn.execute("SELECT id, name, color FROM tags ORDER BY name").fetchall()
-        return [Tag(id=int(r[0]), name=r[1], color=r[2]) for r in rows]
+        cache = self._read_cache()
+        tags = cache.get("tags")
+        if tags is None:
+            cur = self.connect().cursor()
+            cur.execute("SELECT id, name, color FROM tags ORDER BY name")
+            tags = cache["tags"] = tuple(Tag(*r) for r in cur)
+        return list(tags)
 
     def upsert_tag(self, name: str, color: str) -> int:
         tag_name = name.strip()
@@ -250,113 +827,107 @@ class Database:
             raise ValueError("Tag name cannot be empty")
         color_norm = self._normalize_color(color)
 
-        with self.connect() as conn:
-            cur = conn.execute(
-                """
-                INSERT INTO tags(name, color)
-                VALUES (?, ?)
-                ON CONFLICT(name) DO UPDATE SET color=excluded.color
-                """,
-                (tag_name, color_norm),
-            )
-            tag_id = cur.lastrowid
-            # If update, lastrowid may be 0; fetch id.
-            if not tag_id:
-                tag_id = conn.execute(
-                    "SELECT id FROM tags WHERE name = ?", (tag_name,)
-                ).fetchone()[0]
-            conn.commit()
-            return int(tag_id)
+        with self._write() as conn:
+            return self._upsert_tag(conn, tag_name, color_norm)
+
+    def _upsert_tag(self, conn: sqlite3.Connection, tag_name: str, color: str) -> int:
+        # RETURNING reports the row id for both the insert and the update
+        # branch; lastrowid would be stale on a reused connection.
+        row = conn.execute(
+            """
+            INSERT INTO tags(name, color)
+            VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET color=excluded.color
+            RETURNING id
+            """,
+            (tag_name, color),
+        ).fetchone()
+        return int(row[0])
 
     def tag_product(self, product_id: int, name: str, color: str) -> int:
-        if not self.get_product(product_id):
-            raise ValueError("Product not found")
-        tag_id = self.upsert_tag(name, color)
-        with self.connect() as conn:
-            conn.execute(
-                "INSERT OR IGNORE INTO product_tags(product_id, tag_id) VALUES (?, ?)",
-                (product_id, tag_id),
-            )
-            conn.commit()
+        tag_name = name.strip()
+        if not tag_name:
+            raise ValueError("Tag name cannot be empty")
+        color_norm = self._normalize_color(color)
+
+        # Tag upsert and attach commit together; the product_tags foreign key
+        # rejects unknown products and the rollback drops the tag upsert too.
+        try:
+            with self._write() as conn:
+                tag_id = self._upsert_tag(conn, tag_name, color_norm)
+                conn.execute(_ATTACH_TAG_SQL, (product_id, tag_id))
+        except sqlite3.IntegrityError:
+            raise ValueError("Product not found") from None
         return tag_id
 
-    def attach_tag(self, product_id: int, tag_id: int) -> None:
-        if not self.get_product(product_id):
-            raise ValueError("Product not found")
-        with self.connect() as conn:
-            row = conn.execute("SELECT id FROM tags WHERE id = ?", (tag_id,)).fetchone()
-            if not row:
-                raise ValueError("Tag not found")
-            conn.execute(
-                "INSERT OR IGNORE INTO product_tags(product_id, tag_id) VALUES (?, ?)",
-                (product_id, tag_id),
-            )
-            conn.commit()
+    def attach_tag(self, product_id: int, tag_id: int) -> bool:
+        """Attach an existing tag; returns False if it was already attached."""
+
+        # Let the foreign keys do the existence checks; only a failed insert
+        # pays for the lookup that tells the two cases apart.
+        try:
+            with self._write() as conn:
+                row = conn.execute(_ATTACH_TAG_SQL, (product_id, tag_id)).fetchone()
+        except sqlite3.IntegrityError:
+            if self.get_product(product_id) is None:
+                raise ValueError("Product not found") from None
+            raise ValueError("Tag not found") from None
+        return row is not None
 
     def remove_tag_from_product(self, product_id: int, tag_id: int) -> None:
-        with self.connect() as conn:
+        with self._write() as conn:
             conn.execute(
                 "DELETE FROM product_tags WHERE product_id = ? AND tag_id = ?",
                 (product_id, tag_id),
             )
-            conn.commit()
 
     def get_tags_for_product(self, product_id: int) -> list[Tag]:
-        with self.connect() as conn:
-            rows = conn.execute(
-                """
-                SELECT t.id, t.name, t.color
-                FROM product_tags pt
-                JOIN tags t ON t.id = pt.tag_id
-                WHERE pt.product_id = ?
-                ORDER BY t.name
-                """,
-                (product_id,),
-            ).fetchall()
-        return [Tag(id=int(r[0]), name=r[1], color=r[2]) for r in rows]
+        cur = self.connect().cursor()
+        cur.execute(
+            """
+            SELECT t.id, t.name, t.color
+            FROM product_tags pt
+            JOIN tags t ON t.id = pt.tag_id
+            WHERE pt.product_id = ?
+            ORDER BY t.name
+            """,
+            (product_id,),
+        )
+        return [Tag(*r) for r in cur]
 
     def get_tags_for_products(self, product_ids: list[int]) -> dict[int, list[Tag]]:
         if not product_ids:
             return {}
-        placeholders = ",".join(["?"] * len(product_ids))
-        with self.connect() as conn:
-            rows = conn.execute(
-                f"""
-                SELECT pt.product_id, t.id, t.name, t.color
-                FROM product_tags pt
-                JOIN tags t ON t.id = pt.tag_id
-                WHERE pt.product_id IN ({placeholders})
-                ORDER BY t.name
-                """,
-                tuple(product_ids),
-            ).fetchall()
+        cur = self.connect().cursor()
+        cur.execute(_TAGS_FOR_PRODUCTS_SQL, (json.dumps([int(pid) for pid in product_ids]),))
         out: dict[int, list[Tag]] = {pid: [] for pid in product_ids}
-        for r in rows:
-            pid = int(r[0])
-            out.setdefault(pid, []).append(
-                Tag(id=int(r[1]), name=r[2], color=r[3])
-            )
+        for r in cur:
+            out.setdefault(r[0], []).append(Tag(r[1], r[2], r[3]))
         return out
 
     def upsert_product_name(self, product_id: int, name: str) -> None:
-        with self.connect() as conn:
-            conn.execute(
-                "UPDATE products SET name = ? WHERE id = ?", (name, product_id)
-            )
-            conn.commit()
+        with self._write() as conn:
+            conn.execute(_RENAME_PRODUCT_SQL, (name, product_id))
+
+    def delete_product(self, product_id: int) -> bool:
+        """Delete a product with its history and tags; returns False if missing."""
+
+        with self._write() as conn:
+            cur = conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        return cur.rowcount > 0
 
     def move_product(self, product_id: int, *, direction: str) -> None:
         if direction not in {"up", "down"}:
             raise ValueError("direction must be 'up' or 'down'")
 
-        with self.connect() as conn:
+        with self._write() as conn:
             row = conn.execute(
                 "SELECT id, display_order FROM products WHERE id = ?",
                 (product_id,),
             ).fetchone()
             if not row:
                 return
-            current_order = int(row["display_order"])
+            current_order = int(row[1])
 
             if direction == "up":
                 other = conn.execute(
@@ -384,38 +955,35 @@ class Database:
             if not other:
                 return
 
-            other_id = int(other["id"])
-            other_order = int(other["display_order"])
-            conn.execute(
-                "UPDATE products SET display_order = ? WHERE id = ?",
-                (other_order, product_id),
-            )
+            other_id = int(other[0])
+            other_order = int(other[1])
             conn.execute(
-                "UPDATE products SET display_order = ? WHERE id = ?",
-                (current_order, other_id),
+                """
+                UPDATE products
+                SET display_order = CASE id WHEN ? THEN ? WHEN ? THEN ? END
+                WHERE id IN (?, ?)
+                """,
+                (product_id, other_order, other_id, current_order, product_id, other_id),
             )
-            conn.commit()
 
     def set_product_order(self, ordered_product_ids: list[int]) -> None:
         if not ordered_product_ids:
             return
 
-        with self.connect() as conn:
-            rows = conn.execute("SELECT id FROM products").fetchall()
-            existing = {int(r["id"]) for r in rows}
-
-            # Validate: caller must provide a permutation of all products.
-            provided = [int(x) for x in ordered_product_ids]
-            if len(set(provided)) != len(provided):
-                raise ValueError("Duplicate product ids")
-            if set(provided) != existing:
-                raise ValueError("Order must include all product ids")
+        provided = [int(x) for x in ordered_product_ids]
+        if len(set(provided)) != len(provided):
+            raise ValueError("Duplicate product ids")
 
-            conn.executemany(
-                "UPDATE products SET display_order = ? WHERE id = ?",
-                [(idx + 1, pid) for idx, pid in enumerate(provided)],
-            )
-            conn.commit()
+        with self._write() as conn:
+            # Validate: caller must provide a permutation of all products. With
+            # no duplicates and matching counts, the UPDATE touches every row
+            # exactly when no id is unknown; otherwise _write rolls it back.
+            (total,) = conn.execute("SELECT COUNT(*) FROM products").fetchone()
+            if len(provided) != total:
+                raise ValueError("Order must include all product ids")
+            cur = conn.execute(_SET_PRODUCT_ORDER_SQL, (json.dumps(provided),))
+            if cur.rowcount != total:
+                raise ValueError("Order must include all product ids")
 
     def add_observation(
         self,
@@ -429,70 +997,164 @@ class Database:
         raw_price_text: str | None = None,
         error: str | None = None,
     ) -> int:
-        ts_val = int(time.time()) if ts is None else int(ts)
-        in_stock_val = None if in_stock is None else (1 if in_stock else 0)
-        with self.connect() as conn:
-            # Discard impossible or extreme prices before insert.
-            price_to_store = price_cents
-            err_to_store = error
-
-            if price_cents is not None:
-                if price_cents <= 0:
-                    price_to_store = None
-                    if not err_to_store:
-                        err_to_store = "Discarded non-positive price"
-                else:
-                    is_outlier, ref_median = self._is_outlier(
-                        conn, product_id, price_cents
-                    )
-                    if is_outlier:
-                        price_to_store = None
-                        if not err_to_store:
-                            err_to_store = (
-                                f"Discarded outlier vs median {ref_median / 100:.2f}"
-                                if ref_median
-                                else "Discarded outlier"
-                            )
-
+        with self._write() as conn:
             cur = conn.execute(
-                """
-                INSERT INTO observations(product_id, ts, price_cents, currency, in_stock, title, raw_price_text, error)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
+                _INSERT_OBSERVATION_SQL,
+                self._observation_row(
+                    conn,
                     product_id,
-                    ts_val,
-                    price_to_store,
-                    currency,
-                    in_stock_val,
-                    title,
-                    raw_price_text,
-                    err_to_store,
+                    ts=None if ts is None else int(ts),
+                    price_cents=price_cents,
+                    currency=currency,
+                    in_stock=in_stock,
+                    title=title,
+                    raw_price_text=raw_price_text,
+                    error=error,
                 ),
             )
             return int(cur.lastrowid)
 
+    def add_observations(
+        self,
+        observations: Iterable[dict[str, Any]],
+        *,
+        renames: dict[int, str] | None = None,
+        page_cache: Iterable[PageCache] | None = None,
+    ) -> int:
+        """Insert many observations in a single transaction.
+
+        Each item takes ``product_id`` plus the keyword arguments of
+        ``add_observation``. ``renames`` maps product ids to new names and
+        ``page_cache`` entries replace the stored ones; both are applied in the
+        same transaction. Returns the number of rows inserted.
+        """
+
+        now = int(time.time())
+        items = [dict(obs) for obs in observations]
+        with self._write() as conn:
+            # One query fetches screening samples for the whole batch.
+            recent_prices = self._recent_prices(
+                conn, {int(obs["product_id"]) for obs in items}
+            )
+            rows = []
+            for fields in items:
+                product_id = int(fields.pop("product_id"))
+                ts = fields.pop("ts", None)
+                rows.append(
+                    self._observation_row(
+                        conn,
+                        product_id,
+                        ts=now if ts is None else int(ts),
+                        recent_prices=recent_prices,
+                        **fields,
+                    )
+                )
+            if renames:
+                conn.executemany(
+                    _RENAME_PRODUCT_SQL,
+                    [(name, pid) for pid, name in renames.items()],
+                )
+            if rows:
+                conn.executemany(_INSERT_OBSERVATION_SQL, rows)
+            if page_cache:
+                conn.executemany(
+                    _UPSERT_PAGE_CACHE_SQL,
+                    [
+                        (
+                            c.product_id,
+                            c.etag,
+                            c.last_modified,
+                            c.price_cents,
+                            c.currency,
+                            None if c.in_stock is None else int(c.in_stock),
+                            c.title,
+                            c.raw_price_text,
+                        )
+                        for c in page_cache
+                    ],
+                )
+        return len(rows)
+
+    def get_page_cache(self, product_ids: list[int]) -> dict[int, PageCache]:
+        if not product_ids:
+            return {}
+        cur = self.connect().cursor()
+        cur.execute(_PAGE_CACHE_FOR_SQL, (json.dumps([int(pid) for pid in product_ids]),))
+        return {
+            r[0]: PageCache(
+                r[0], r[1], r[2], r[3], r[4], None if r[5] is None else bool(r[5]), r[6], r[7]
+            )
+            for r in cur
+        }
+
+    def _observation_row(
+        self,
+        conn: sqlite3.Connection,
+        product_id: int,
+        *,
+        ts: int | None,
+        price_cents: int | None = None,
+        currency: str | None = None,
+        in_stock: bool | None = None,
+        title: str | None = None,
+        raw_price_text: str | None = None,
+        error: str | None = None,
+        recent_prices: dict[int, list[int]] | None = None,
+    ) -> tuple[Any, ...]:
+        in_stock_val = None if in_stock is None else (1 if in_stock else 0)
+
+        # Discard impossible or extreme prices before insert.
+        price_to_store = price_cents
+        err_to_store = error
+
+        if price_cents is not None:
+            if price_cents <= 0:
+                price_to_store = None
+                if not err_to_store:
+                    err_to_store = "Discarded non-positive price"
+            else:
+                is_outlier, ref_median = self._is_outlier(
+                    conn,
+                    product_id,
+                    price_cents,
+                    prices=None if recent_prices is None else recent_prices.get(product_id, []),
+                )
+                if is_outlier:
+                    price_to_store = None
+                    if not err_to_store:
+                        err_to_store = (
+                            f"Discarded outlier vs median {ref_median / 100:.2f}"
+                            if ref_median
+                            else "Discarded outlier"
+                        )
+
+        return (
+            product_id,
+            ts,
+            price_to_store,
+            currency,
+            in_stock_val,
+            title,
+            raw_price_text,
+            err_to_store,
+        )
+
     def _is_outlier(
         self,
         conn: sqlite3.Connection,
         product_id: int,
         price_cents: int,
         *,
+        prices: list[int] | None = None,
         factor: float = 6.0,
         min_samples: int = 3,
-        sample_limit: int = 50,
+        sample_limit: int = _OUTLIER_SAMPLE_LIMIT,
     ) -> tuple[bool, float | None]:
-        rows = conn.execute(
-            """
-            SELECT price_cents
-            FROM observations
-            WHERE product_id = ? AND price_cents IS NOT NULL
-            ORDER BY ts DESC
-            LIMIT ?
-            """,
-            (product_id, sample_limit),
-        ).fetchall()
-        prices = [int(r[0]) for r in rows if r[0] is not None]
+        if prices is None:
+            rows = conn.execute(
+                _OUTLIER_SAMPLES_SQL, (product_id, sample_limit)
+            ).fetchall()
+            prices = [int(r[0]) for r in rows]
         if len(prices) < min_samples:
             return (False, None)
         median = self._median(prices)
@@ -504,95 +1166,71 @@ class Database:
             return (True, median)
         return (False, median)
 
+    def _recent_prices(
+        self,
+        conn: sqlite3.Connection,
+        product_ids: Iterable[int],
+        *,
+        sample_limit: int = _OUTLIER_SAMPLE_LIMIT,
+    ) -> dict[int, list[int]]:
+        ids = sorted(product_ids)
+        if not ids:
+            return {}
+        # One row per product with its samples packed into a string keeps the
+        # lookup inside the covering idx_observations_priced.
+        return {
+            pid: [int(p) for p in packed.split(",")] if packed else []
+            for pid, packed in conn.execute(
+                _OUTLIER_SAMPLES_FOR_SQL, (sample_limit, json.dumps(ids))
+            )
+        }
+
     def get_priced_observation_at_or_before(
         self, product_id: int, ts: int
     ) -> Observation | None:
-        with self.connect() as conn:
-            row = conn.execute(
-                """
-                SELECT id, product_id, ts, price_cents, currency, in_stock, title, raw_price_text, error
-                FROM observations
-                WHERE product_id = ?
-                  AND ts <= ?
-                  AND price_cents IS NOT NULL
-                ORDER BY ts DESC
-                LIMIT 1
-                """,
-                (product_id, int(ts)),
-            ).fetchone()
-        if not row:
+        cur = self.connect().cursor()
+        r = cur.execute(_PRICED_AT_OR_BEFORE_SQL, (product_id, int(ts))).fetchone()
+        if not r:
             return None
-        return Observation(
-            id=int(row["id"]),
-            product_id=int(row["product_id"]),
-            ts=int(row["ts"]),
-            price_cents=row["price_cents"],
-            currency=row["currency"],
-            in_stock=(None if row["in_stock"] is None else bool(int(row["in_stock"]))),
-            title=row["title"],
-            raw_price_text=row["raw_price_text"],
-            error=row["error"],
-        )
+        return _row_to_observation(r)
 
-    def get_latest_observations(self) -> dict[int, Observation]:
-        with self.connect() as conn:
-            rows = conn.execute(
-                """
-                SELECT o.*
-                FROM observations o
-                JOIN (
-                  SELECT product_id, MAX(ts) AS max_ts
-                  FROM observations
-                  GROUP BY product_id
-                ) last
-                ON last.product_id = o.product_id AND last.max_ts = o.ts
-                """
-            ).fetchall()
-        latest: dict[int, Observation] = {}
-        for r in rows:
-            latest[int(r["product_id"])] = Observation(
-                id=int(r["id"]),
-                product_id=int(r["product_id"]),
-                ts=int(r["ts"]),
-                price_cents=r["price_cents"],
-                currency=r["currency"],
-                in_stock=(None if r["in_stock"] is None else bool(int(r["in_stock"]))),
-                title=r["title"],
-                raw_price_text=r["raw_price_text"],
-                error=r["error"],
+    def get_product_dashboard(self, cutoff_ts: int) -> list[DashboardRow]:
+        """Dashboard rows; ``change`` is the price move since ``cutoff_ts``."""
+
+        cur = self.connect().cursor()
+        cur.execute(_DASHBOARD_SQL, {"cutoff": cutoff_ts})
+        return [DashboardRow(*r) for r in cur]
+
+    def get_poll_schedule(self) -> dict[int, tuple[int | None, int | None]]:
+        """Map product id to (poll_interval_s, next_poll_ts); either may be None."""
+
+        cur = self.connect().cursor()
+        cur.execute("SELECT id, poll_interval_s, next_poll_ts FROM products")
+        return {r[0]: (r[1], r[2]) for r in cur}
+
+    def set_poll_schedule(self, schedule: dict[int, tuple[int, int]]) -> None:
+        with self._write() as conn:
+            conn.executemany(
+                "UPDATE products SET poll_interval_s = ?, next_poll_ts = ? WHERE id = ?",
+                [(interval, next_ts, pid) for pid, (interval, next_ts) in schedule.items()],
             )
-        return latest
+
+    def get_latest_observations(self) -> dict[int, Observation]:
+        cur = self.connect().cursor()
+        cur.execute(_LATEST_OBSERVATIONS_SQL)
+        return {r[1]: _row_to_observation(r) for r in cur}
 
     def get_history(self, product_id: int, limit: int = 200) -> list[Observation]:
-        with self.connect() as conn:
-            rows = conn.execute(
-                """
-                SELECT id, product_id, ts, price_cents, currency, in_stock, title, raw_price_text, error
-                FROM observations
-                WHERE product_id = ?
-                ORDER BY ts DESC
-                LIMIT ?
-                """,
-                (product_id, limit),
-            ).fetchall()
-        out: list[Observation] = []
-        for r in rows:
-            out.append(
-                Observation(
-                    id=int(r["id"]),
-                    product_id=int(r["product_id"]),
-                    ts=int(r["ts"]),
-                    price_cents=r["price_cents"],
-                    currency=r["currency"],
-                    in_stock=(
-                        None if r["in_stock"] is None else bool(int(r["in_stock"]))
-                    ),
-                    title=r["title"],
-                    raw_price_text=r["raw_price_text"],
-                    error=r["error"],
-                )
-            )
-        return out
+        cur = self.connect().cursor()
+        cur.execute(_HISTORY_SQL, (product_id, limit))
+        return [_row_to_observation(r) for r in cur]
+
+    def get_history_asc(self, product_id: int, limit: int = 200) -> list[Observation]:
+        """The newest ``limit`` observations, oldest first (for charts)."""
+
+        cur = self.connect().cursor()
+        cur.execute(_HISTORY_ASC_SQL, (product_id, limit))
+        return [_row_to_observation(r) for r in cur]
 
     def clean_price_outliers(
         self, *, factor: float = 6.0, min_samples: int = 3, sample_limit: int = 200
@@ -603,61 +1241,68 @@ class Database:
         """
 
         removed = 0
-        with self.connect() as conn:
+        with self._write() as conn:
             # First drop impossible non-positive prices.
             cur = conn.execute(
                 "DELETE FROM observations WHERE price_cents IS NOT NULL AND price_cents <= 0"
             )
             removed += cur.rowcount if cur.rowcount is not None else 0
 
-            product_ids = [int(r[0]) for r in conn.execute("SELECT id FROM products")]
-            for pid in product_ids:
-                rows = conn.execute(
-                    """
-                    SELECT id, price_cents
-                    FROM observations
-                    WHERE product_id = ? AND price_cents IS NOT NULL
-                    ORDER BY ts DESC
-                    LIMIT ?
-                    """,
-                    (pid, sample_limit),
-                ).fetchall()
-
-                prices = [int(r[1]) for r in rows if r[1] is not None]
-                if len(prices) < min_samples:
-                    continue
-
-                median = self._median(prices)
-                if median <= 0:
-                    continue
-                lower = median / factor
-                upper = median * factor
-
-                bad_ids = [int(r[0]) for r in rows if r[1] < lower or r[1] > upper]
-                if bad_ids:
-                    conn.executemany(
-                        "DELETE FROM observations WHERE id = ?",
-                        [(bid,) for bid in bad_ids],
-                    )
-                    removed += len(bad_ids)
+            cur = conn.execute(
+                _DELETE_OUTLIERS_SQL,
+                {
+                    "factor": factor,
+                    "min_samples": min_samples,
+                    "sample_limit": sample_limit,
+                },
+            )
+            removed += cur.rowcount if cur.rowcount is not None else 0
 
-            conn.commit()
+            conn.execute(
+                "INSERT OR REPLACE INTO meta(key, value) VALUES ('last_clean', ?)",
+                (int(time.time()),),
+            )
 
         return removed
 
-    def iter_observations(self, product_ids: Iterable[int] | None = None):
-        with self.connect() as conn:
-            if product_ids is None:
-                rows = conn.execute(
-                    "SELECT * FROM observations ORDER BY ts DESC"
-                ).fetchall()
-            else:
-                ids = list(product_ids)
-                if not ids:
-                    return []
-                placeholders = ",".join(["?"] * len(ids))
-                rows = conn.execute(
-                    f"SELECT * FROM observations WHERE product_id IN ({placeholders}) ORDER BY ts DESC",
-                    tuple(ids),
-                ).fetchall()
-        return rows
+    def clear(self, *, vacuum: bool = False) -> None:
+        """Delete all products and observations (tags are kept)."""
+
+        conn = self.connect()
+        # With foreign keys enforced SQLite deletes row by row to run the
+        # cascades; emptying every table ourselves lets it truncate instead.
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            with self._write():
+                conn.execute("DELETE FROM product_tags")
+                conn.execute("DELETE FROM page_cache")
+                conn.execute("DELETE FROM observations")
+                conn.execute("DELETE FROM products")
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+        if vacuum:
+            conn.execute("VACUUM")
+
+    def iter_observations(
+        self, product_ids: Iterable[int] | None = None
+    ) -> Iterator[tuple[Any, ...]]:
+        """Yield observations newest-first straight from the cursor.
+
+        Rows are plain tuples in ``observations`` column order (id, product_id,
+        ts, price_cents, currency, in_stock, title, raw_price_text, error) and
+        are streamed rather than fetched up front, so exporting a large history
+        uses constant memory.
+        """
+
+        cur = self.connect().cursor()
+        if product_ids is None:
+            cur.execute(_ITER_OBSERVATIONS_SQL)
+        else:
+            ids = [int(pid) for pid in product_ids]
+            if not ids:
+                return
+            cur.execute(_ITER_OBSERVATIONS_FOR_SQL, (json.dumps(ids),))
+        try:
+            yield from cur
+        finally:
+            cur.close()
@@ -2,7 +2,10 @@ from __future__ import annotations
 
 import asyncio
 import sys
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Mapping
 from urllib.parse import urlparse
 
 import httpx
@@ -14,10 +17,18 @@ class FetchResult:
     final_url: str
     status_code: int
     text: str
+    etag: str | None = None
+    last_modified: str | None = None
 
 
 def detect_source(url: str) -> str:
-    host = (urlparse(url).hostname or "").lower()
+    return _source_for_host(urlparse(url).hostname or "")
+
+
+@lru_cache(maxsize=1024)
+def _source_for_host(hostname: str) -> str:
+    # Keyed by host rather than URL: listing pages repeat a handful of hosts.
+    host = hostname.lower()
     if host.endswith("x-kom.pl") or host.endswith("www.x-kom.pl"):
         return "x-kom"
     if host.endswith("morele.net") or host.endswith("www.morele.net"):
@@ -27,21 +38,28 @@ def detect_source(url: str) -> str:
     return host or "unknown"
 
 
-def _looks_like_block(text: str) -> bool:
-    lower = text.lower()
-    return any(
-        token in lower
-        for token in [
-            "captcha",
-            "robot check",
-            "access denied",
-            "forbidden",
-            "cloudflare",
-        ]
-    )
+# Matched against the lowered body bytes: bytes.lower() only folds ASCII and
+# is several times cheaper than str.lower() on large non-ASCII pages.
+_BLOCK_TOKENS = (b"captcha", b"robot check", b"access denied", b"forbidden", b"cloudflare")
 
+# WAF and CAPTCHA interstitials are small pages that announce themselves in
+# their head; only this much of a response is searched for block tokens.
+BLOCK_SCAN_BYTES = 16384
 
-def _headers_for_source(source: str) -> dict[str, str]:
+
+def _looks_like_block(content: bytes) -> bool:
+    lower = content[:BLOCK_SCAN_BYTES].lower()
+    return any(token in lower for token in _BLOCK_TOKENS)
+
+
+def _is_markup(resp: httpx.Response) -> bool:
+    content_type = resp.headers.get("content-type", "").lower()
+    if not content_type or content_type.startswith("text/"):
+        return True
+    return "html" in content_type or "xml" in content_type
+
+
+def _build_headers(source: str) -> dict[str, str]:
     # Keep it simple: reasonable browser UA and language.
     # Some sites block aggressively; we store errors when blocked.
     base = {
@@ -71,12 +89,64 @@ def _headers_for_source(source: str) -> dict[str, str]:
     return base
 
 
+# Built once at import; only these sources get tailored headers.
+_HEADERS_BY_SOURCE: Mapping[str, Mapping[str, str]] = MappingProxyType(
+    {
+        source: MappingProxyType(_build_headers(source))
+        for source in ("x-kom", "morele", "amazon", "unknown")
+    }
+)
+
+
+def _headers_for_source(source: str) -> dict[str, str]:
+    return dict(_HEADERS_BY_SOURCE.get(source) or _HEADERS_BY_SOURCE["unknown"])
+
+
+@dataclass
+class _LoopResources:
+    """Long-lived fetch resources; httpx and Playwright objects are bound to one event loop."""
+
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    clients: dict[str, httpx.AsyncClient] = field(default_factory=dict)
+    playwright: Any = None
+    browser: Any = None
+
+
+_LOOP_RESOURCES: dict[asyncio.AbstractEventLoop, _LoopResources] = {}
+
+
+def _loop_resources() -> _LoopResources:
+    loop = asyncio.get_running_loop()
+    res = _LOOP_RESOURCES.get(loop)
+    if res is None:
+        res = _LOOP_RESOURCES[loop] = _LoopResources()
+    return res
+
+
+def _get_client(source: str) -> httpx.AsyncClient:
+    """Return this loop's client for a source so repeat polls reuse warm connections."""
+    res = _loop_resources()
+    client = res.clients.get(source)
+    if client is None or client.is_closed:
+        client = res.clients[source] = httpx.AsyncClient(
+            follow_redirects=True,
+            headers=_headers_for_source(source),
+            http2=False,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+    return client
+
+
 async def fetch_html(
     url: str,
     source: str | None = None,
     timeout_s: float = 20.0,
     prefer_browser: bool = False,
+    *,
+    etag: str | None = None,
+    last_modified: str | None = None,
 ) -> FetchResult:
+    """Fetch a page; pass validators from an earlier FetchResult to allow a 304."""
     src = source or detect_source(url)
 
     if prefer_browser:
@@ -85,24 +155,29 @@ async def fetch_html(
             return fallback
 
     try:
-        async with httpx.AsyncClient(
-            follow_redirects=True,
-            timeout=httpx.Timeout(timeout_s),
-            headers=_headers_for_source(src),
-            http2=False,
-        ) as client:
-            resp = await client.get(url)
-            if resp.status_code == 403 or (resp.status_code < 500 and _looks_like_block(resp.text)):
-                fallback = await _try_playwright(url, headers=_headers_for_source(src))
-                if fallback:
-                    return fallback
-
-            return FetchResult(
-                url=url,
-                final_url=str(resp.url),
-                status_code=resp.status_code,
-                text=resp.text,
-            )
+        conditional: dict[str, str] = {}
+        if etag:
+            conditional["if-none-match"] = etag
+        if last_modified:
+            conditional["if-modified-since"] = last_modified
+        resp = await _get_client(src).get(url, timeout=timeout_s, headers=conditional)
+        markup = _is_markup(resp)
+        if resp.status_code == 403 or (
+            markup and resp.status_code < 500 and _looks_like_block(resp.content)
+        ):
+            fallback = await _try_playwright(url, headers=_headers_for_source(src))
+            if fallback:
+                return fallback
+
+        return FetchResult(
+            url=url,
+            final_url=str(resp.url),
+            status_code=resp.status_code,
+            # Images, PDFs and other downloads have no price markup to parse.
+            text=resp.text if markup else "",
+            etag=resp.headers.get("etag"),
+            last_modified=resp.headers.get("last-modified"),
+        )
     except Exception:
         fallback = await _try_playwright(url, headers=_headers_for_source(src))
         if fallback:
@@ -114,6 +189,38 @@ _PLAYWRIGHT_INSTALL_LOCK = asyncio.Lock()
 _PLAYWRIGHT_READY = False
 
 
+async def _get_browser() -> Any:
+    """Return this loop's headless Chromium, launching (or relaunching) it on demand."""
+    res = _loop_resources()
+    async with res.lock:
+        if res.browser is None or not res.browser.is_connected():
+            from playwright.async_api import async_playwright
+
+            if res.playwright is None:
+                res.playwright = await async_playwright().start()
+            res.browser = await res.playwright.chromium.launch(
+                headless=True,
+                args=["--disable-blink-features=AutomationControlled"],
+            )
+        return res.browser
+
+
+async def aclose() -> None:
+    """Release the shared resources held for the running event loop."""
+    res = _LOOP_RESOURCES.pop(asyncio.get_running_loop(), None)
+    if res is None:
+        return
+    for client in res.clients.values():
+        await client.aclose()
+    try:
+        if res.browser is not None:
+            await res.browser.close()
+        if res.playwright is not None:
+            await res.playwright.stop()
+    except Exception:
+        pass
+
+
 async def _ensure_playwright() -> bool:
     global _PLAYWRIGHT_READY
     if _PLAYWRIGHT_READY:
@@ -127,12 +234,9 @@ async def _ensure_playwright() -> bool:
             return False
 
         # Try to launch quickly; if browser missing, install chromium once.
+        # The probe browser stays up for the fetches that follow.
         try:
-            from playwright.async_api import async_playwright
-
-            async with async_playwright() as pw:
-                browser = await pw.chromium.launch(headless=True)
-                await browser.close()
+            await _get_browser()
             _PLAYWRIGHT_READY = True
             return True
         except Exception:
@@ -161,23 +265,21 @@ async def _try_playwright(url: str, headers: dict[str, str]) -> FetchResult | No
     if not ok:
         return None
     try:
-        from playwright.async_api import async_playwright
-
-        async with async_playwright() as pw:
-            browser = await pw.chromium.launch(
-                headless=True,
-                args=["--disable-blink-features=AutomationControlled"],
-            )
-            context = await browser.new_context(
-                extra_http_headers=headers,
-                locale="pl-PL",
-            )
+        # A fresh context per URL keeps cookies and storage isolated; only
+        # the browser process is shared.
+        browser = await _get_browser()
+        context = await browser.new_context(
+            extra_http_headers=headers,
+            locale="pl-PL",
+        )
+        try:
             page = await context.new_page()
             response = await page.goto(url, wait_until="networkidle", timeout=30000)
             content = await page.content()
             final_url = page.url
             status = response.status if response else 0
-            await browser.close()
-            return FetchResult(url=url, final_url=final_url, status_code=status, text=content)
+        finally:
+            await context.close()
+        return FetchResult(url=url, final_url=final_url, status_code=status, text=content)
     except Exception:
         return None
@@ -1,12 +1,24 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import math
 import re
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
 from decimal import Decimal, InvalidOperation
 from typing import Any
 
-from selectolax.parser import HTMLParser
+from selectolax.parser import HTMLParser, Node
+
+# orjson (the "speedups" extra) parses large JSON-LD blobs several times faster.
+try:
+    import orjson
+except ImportError:
+    _json_loads = json.loads
+else:
+    _json_loads = orjson.loads
 
 
 @dataclass(frozen=True)
@@ -25,23 +37,19 @@ _PRICE_RE = re.compile(
 )
 
 
+# Spaces are grouping; the last of "," / "." is the decimal separator and the
+# other one is grouping too. Either way it is a single translate pass.
+_DECIMAL_COMMA = str.maketrans({"\u00A0": None, " ": None, ".": None, ",": "."})
+_DECIMAL_DOT = str.maketrans({"\u00A0": None, " ": None, ",": None})
+
+
 def _clean_number(text: str) -> str:
     # common formats:
     # 5 999,00  | 5 999,00 | 5,999.00 | 5999
-    t = text.replace("\u00A0", " ")
-    t = t.replace(" ", "")
-    # If both separators appear, assume last is decimal.
-    if "," in t and "." in t:
-        if t.rfind(",") > t.rfind("."):
-            t = t.replace(".", "")
-            t = t.replace(",", ".")
-        else:
-            t = t.replace(",", "")
-    else:
-        # If only comma, treat as decimal separator.
-        if "," in t:
-            t = t.replace(",", ".")
-    return t
+    # A lone comma is a decimal separator; a lone dot stays as it is.
+    if "." in text and text.rfind(",") < text.rfind("."):
+        return text.translate(_DECIMAL_DOT)
+    return text.translate(_DECIMAL_COMMA)
 
 
 def _decimal_to_cents(value: str) -> int | None:
@@ -52,32 +60,74 @@ def _decimal_to_cents(value: str) -> int | None:
     return int((d * 100).quantize(Decimal("1")))
 
 
+def _num_to_cents(value: int | float) -> int | None:
+    # JSON ints are exact and need no Decimal round-trip. Floats go through
+    # their shortest repr so 2.675 rounds like the string "2.675" does, not
+    # like the binary double just below it. JSON true/false are not prices.
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value * 100
+    if not math.isfinite(value):
+        return None
+    return _decimal_to_cents(repr(value))
+
+
+_BLOCK_SCAN_CHARS = 16384
+
+_JSONLD_TYPE = "application/ld+json"
+_META_PROPERTIES = frozenset({"og:title", "product:price:amount", "product:price:currency"})
+
+
 def _iter_jsonld_objects(doc: HTMLParser) -> list[Any]:
     out: list[Any] = []
-    for node in doc.css('script[type="application/ld+json"]'):
+    # doc.tags() reads the parser's per-tag node list instead of matching a
+    # selector against every element.
+    for node in doc.tags("script"):
+        if node.attributes.get("type") != _JSONLD_TYPE:
+            continue
         raw = (node.text() or "").strip()
         if not raw:
             continue
         try:
-            data = json.loads(raw)
+            data = _json_loads(raw)
         except Exception:
             continue
         out.append(data)
     return out
 
 
-def _walk(obj: Any):
-    if isinstance(obj, dict):
-        yield obj
-        for v in obj.values():
-            yield from _walk(v)
-    elif isinstance(obj, list):
-        for it in obj:
-            yield from _walk(it)
+def _find_offer_price(root: Any) -> tuple[int | None, str | None, str | None]:
+    """First priced ``offers`` in a JSON-LD tree, as (price_cents, currency, raw_text)."""
+    # Pre-order over nested dicts/lists without a generator frame per level;
+    # children are pushed reversed so dicts are visited in document order.
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            offers = item.get("offers")
+            if offers is not None:
+                found = _parse_offer_price(offers)
+                if found[0] is not None:
+                    return found
+            stack.extend(reversed(item.values()))
+        elif isinstance(item, list):
+            stack.extend(reversed(item))
+    return (None, None, None)
+
+
+def _meta_by_property(doc: HTMLParser) -> dict[str, Node]:
+    """First <meta> node for each property we read, gathered in one pass."""
+    out: dict[str, Node] = {}
+    for node in doc.tags("meta"):
+        prop = node.attributes.get("property")
+        if prop in _META_PROPERTIES and prop not in out:
+            out[prop] = node
+    return out
 
 
-def _extract_title(doc: HTMLParser) -> str | None:
-    og = doc.css_first('meta[property="og:title"]')
+def _extract_title(doc: HTMLParser, meta: dict[str, Node]) -> str | None:
+    og = meta.get("og:title")
     if og and og.attributes.get("content"):
         return og.attributes.get("content")
     title = doc.css_first("title")
@@ -108,8 +158,7 @@ def _parse_offer_price(offers: Any) -> tuple[int | None, str | None, str | None]
             continue
 
         if isinstance(price, (int, float)):
-            cents = _decimal_to_cents(str(price))
-            return (cents, currency, str(price))
+            return (_num_to_cents(price), currency, str(price))
 
         if isinstance(price, str):
             cleaned = _clean_number(price)
@@ -119,12 +168,48 @@ def _parse_offer_price(offers: Any) -> tuple[int | None, str | None, str | None]
     return (None, None, None)
 
 
+# Recent results keyed by a digest of the page; polling an unchanged page
+# costs one hash instead of a full parse.
+_PARSED_CACHE_SIZE = 256
+_parsed_cache: OrderedDict[bytes, ParsedPrice] = OrderedDict()
+_parsed_cache_lock = threading.Lock()
+
+
+def lookup_parsed(html: str) -> tuple[bytes, ParsedPrice | None]:
+    """Digest of ``html`` and its remembered parse, if there is one."""
+
+    key = hashlib.blake2b(html.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _parsed_cache_lock:
+        parsed = _parsed_cache.get(key)
+        if parsed is not None:
+            _parsed_cache.move_to_end(key)
+    return key, parsed
+
+
+def remember_parsed(key: bytes, parsed: ParsedPrice) -> None:
+    with _parsed_cache_lock:
+        _parsed_cache[key] = parsed
+        if len(_parsed_cache) > _PARSED_CACHE_SIZE:
+            _parsed_cache.popitem(last=False)
+
+
 def extract_price(html: str) -> ParsedPrice:
+    key, parsed = lookup_parsed(html)
+    if parsed is None:
+        parsed = _extract_price(html)
+        remember_parsed(key, parsed)
+    return parsed
+
+
+def _extract_price(html: str) -> ParsedPrice:
     doc = HTMLParser(html)
-    title = _extract_title(doc)
+    meta = _meta_by_property(doc)
+    title = _extract_title(doc, meta)
 
-    lower = html.lower()
-    if "robot check" in lower or "captcha" in lower and "amazon" in lower:
+    # CAPTCHA interstitials are small, so the page head is enough. ASCII-only
+    # lowering of the encoded prefix; the tokens are plain ASCII.
+    lower = html[:_BLOCK_SCAN_CHARS].encode("utf-8", "surrogatepass").lower()
+    if b"robot check" in lower or (b"captcha" in lower and b"amazon" in lower):
         return ParsedPrice(
             price_cents=None,
             currency=None,
@@ -136,26 +221,22 @@ def extract_price(html: str) -> ParsedPrice:
 
     # 1) JSON-LD schema.org
     for data in _iter_jsonld_objects(doc):
-        for obj in _walk(data):
-            if not isinstance(obj, dict):
-                continue
-            offers = obj.get("offers")
-            cents, currency, raw = _parse_offer_price(offers)
-            if cents is not None:
-                return ParsedPrice(
-                    price_cents=cents,
-                    currency=currency,
-                    title=title,
-                    raw_price_text=raw,
-                    in_stock=None,
-                )
+        cents, currency, raw = _find_offer_price(data)
+        if cents is not None:
+            return ParsedPrice(
+                price_cents=cents,
+                currency=currency,
+                title=title,
+                raw_price_text=raw,
+                in_stock=None,
+            )
 
     # 2) OpenGraph / meta tags
-    meta_amt = doc.css_first('meta[property="product:price:amount"]')
+    meta_amt = meta.get("product:price:amount")
     if meta_amt and meta_amt.attributes.get("content"):
         amt = meta_amt.attributes["content"]
         cents = _decimal_to_cents(_clean_number(amt))
-        meta_cur = doc.css_first('meta[property="product:price:currency"]')
+        meta_cur = meta.get("product:price:currency")
         cur = meta_cur.attributes.get("content") if meta_cur else None
         if cents is not None and cents > 0:
             return ParsedPrice(
@@ -1,12 +1,52 @@
 from __future__ import annotations
 
 import asyncio
+import atexit
+import multiprocessing
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
+from typing import Any, AsyncIterator
 
-from .db import Database
+from .db import Database, PageCache, Product
 from .fetch import detect_source, fetch_html
-from .parse import extract_price
+from .parse import ParsedPrice, extract_price, lookup_parsed, remember_parsed
+
+# How often the long-running poller refreshes SQLite planner statistics.
+MAINTENANCE_INTERVAL_S = 900
+
+# run_forever stretches a product's interval by this factor after each poll
+# that leaves its price unchanged, up to MAX_POLL_BACKOFF times the base
+# interval; a change (or an error) halves it again, down to the base.
+POLL_BACKOFF_FACTOR = 1.5
+MAX_POLL_BACKOFF = 8
+
+# When offloading is enabled (the long-running poller), poll_all batches at
+# least this large parse pages in worker processes so CPU-bound HTML parsing
+# runs on other cores while fetches continue. Each spawned worker cold-imports
+# selectolax and this package, so small batches parse faster inline.
+PARSE_POOL_MIN_BATCH = 32
+PARSE_POOL_MAX_WORKERS = 4
+
+_PARSE_POOL: ProcessPoolExecutor | None = None
+
+
+def _parse_pool() -> ProcessPoolExecutor | None:
+    """Lazily started parse workers; None on single-core machines."""
+    global _PARSE_POOL
+    if _PARSE_POOL is None:
+        cpus = os.cpu_count() or 1
+        if cpus < 2:
+            return None
+        # spawn: the poller may already run threads (SQLite, web server), which
+        # fork does not copy safely.
+        _PARSE_POOL = ProcessPoolExecutor(
+            max_workers=min(cpus, PARSE_POOL_MAX_WORKERS), mp_context=multiprocessing.get_context("spawn")
+        )
+        atexit.register(_PARSE_POOL.shutdown)
+    return _PARSE_POOL
 
 
 @dataclass(frozen=True)
@@ -16,76 +56,254 @@ class PollResult:
     error: str | None
 
 
-async def poll_product(db: Database, product_id: int) -> PollResult:
-    product = db.get_product(product_id)
-    if not product:
-        return PollResult(product_id=product_id, ok=False, error="Unknown product")
+class Admission:
+    """Bound concurrent work, like a semaphore whose limit can change live."""
+
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        self._cond = asyncio.Condition()
+        self._active = 0
+        self._limit = limit
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    async def resize(self, limit: int) -> None:
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        async with self._cond:
+            self._limit = limit
+            self._cond.notify_all()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < self._limit)
+            self._active += 1
+
+    async def release(self) -> None:
+        # Free the slot before waiting on the lock so a cancellation here
+        # cannot leak it.
+        self._active -= 1
+        async with self._cond:
+            self._cond.notify(1)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release()
+
+
+class HostLimiter:
+    """Per-source concurrency caps so a single store is never flooded."""
+
+    def __init__(self, per_host: int):
+        self._per_host = per_host
+        self._slots: dict[str, Admission] = {}
 
+    def slot(self, source: str):
+        admission = self._slots.get(source)
+        if admission is None:
+            admission = self._slots[source] = Admission(self._per_host)
+        return admission.slot()
+
+
+def _needs_name(product: Product, title: str | None) -> bool:
+    """Products added by bare URL take the first parsed page title as their name."""
+
+    return bool(title) and (not product.name or product.name.startswith("http"))
+
+
+async def _extract(html: str, *, offload: bool) -> ParsedPrice:
+    pool = _parse_pool() if offload else None
+    if pool is None:
+        return extract_price(html)
+    # Consult this process's memo first; workers have their own, so results
+    # parsed there are remembered here too.
+    key, parsed = lookup_parsed(html)
+    if parsed is None:
+        parsed = await asyncio.get_running_loop().run_in_executor(pool, extract_price, html)
+        remember_parsed(key, parsed)
+    return parsed
+
+
+async def _poll(
+    db: Database,
+    product: Product,
+    *,
+    offload: bool = False,
+    cached: PageCache | None = None,
+) -> tuple[PollResult, dict[str, Any], PageCache | None]:
+    """Fetch and parse one product; return the observation instead of storing it.
+
+    The third element is the page cache entry to store, if the response
+    carried validators.
+    """
+
+    product_id = product.id
     source = product.source or detect_source(product.url)
 
     try:
-        res = await fetch_html(product.url, source=source)
+        res = await fetch_html(
+            product.url,
+            source=source,
+            etag=None if cached is None else cached.etag,
+            last_modified=None if cached is None else cached.last_modified,
+        )
+        if res.status_code == 304 and cached is not None:
+            # Unchanged since the cached parse: nothing downloaded, nothing to parse.
+            return (
+                PollResult(product_id=product_id, ok=True, error=None),
+                {
+                    "product_id": product_id,
+                    "price_cents": cached.price_cents,
+                    "currency": cached.currency,
+                    "in_stock": cached.in_stock,
+                    "title": cached.title,
+                    "raw_price_text": cached.raw_price_text,
+                },
+                None,
+            )
         if res.status_code >= 400:
             # Try browser fallback once before recording error.
             res_fallback = await fetch_html(product.url, source=source, prefer_browser=True)
             if res_fallback.status_code < 400:
                 res = res_fallback
             else:
-                db.add_observation(
-                    product_id,
-                    price_cents=None,
-                    currency=None,
-                    in_stock=None,
-                    title=None,
-                    raw_price_text=None,
-                    error=f"HTTP {res_fallback.status_code}",
+                error = f"HTTP {res_fallback.status_code}"
+                return (
+                    PollResult(product_id=product_id, ok=False, error=error),
+                    {"product_id": product_id, "error": error},
+                    None,
                 )
-                return PollResult(product_id=product_id, ok=False, error=f"HTTP {res_fallback.status_code}")
-
-        parsed = extract_price(res.text)
-        if parsed.title and (not product.name or product.name.startswith("http")):
-            db.upsert_product_name(product_id, parsed.title)
-
-        db.add_observation(
-            product_id,
-            price_cents=parsed.price_cents,
-            currency=parsed.currency,
-            in_stock=parsed.in_stock,
-            title=parsed.title,
-            raw_price_text=parsed.raw_price_text,
-            error=parsed.error,
+
+        parsed = await _extract(res.text, offload=offload)
+        page = None
+        if parsed.error is None and (res.etag or res.last_modified):
+            page = PageCache(
+                product_id,
+                res.etag,
+                res.last_modified,
+                parsed.price_cents,
+                parsed.currency,
+                parsed.in_stock,
+                parsed.title,
+                parsed.raw_price_text,
+            )
+        return (
+            PollResult(product_id=product_id, ok=(parsed.error is None), error=parsed.error),
+            {
+                "product_id": product_id,
+                "price_cents": parsed.price_cents,
+                "currency": parsed.currency,
+                "in_stock": parsed.in_stock,
+                "title": parsed.title,
+                "raw_price_text": parsed.raw_price_text,
+                "error": parsed.error,
+            },
+            page,
         )
-        return PollResult(product_id=product_id, ok=(parsed.error is None), error=parsed.error)
 
     except Exception as e:
-        db.add_observation(
-            product_id,
-            price_cents=None,
-            currency=None,
-            in_stock=None,
-            title=None,
-            raw_price_text=None,
-            error=f"Exception: {type(e).__name__}: {e}",
+        return (
+            PollResult(product_id=product_id, ok=False, error=str(e)),
+            {"product_id": product_id, "error": f"Exception: {type(e).__name__}: {e}"},
+            None,
         )
-        return PollResult(product_id=product_id, ok=False, error=str(e))
 
 
-async def poll_all(db: Database, concurrency: int = 6) -> list[PollResult]:
-    products = db.get_products()
-    sem = asyncio.Semaphore(concurrency)
+async def poll_all(
+    db: Database,
+    concurrency: int = 6,
+    per_host: int = 3,
+    *,
+    products: list[Product] | None = None,
+    offload_parsing: bool = False,
+) -> list[PollResult]:
+    """Poll ``products`` (default: all tracked products) and store one batch.
+
+    ``offload_parsing`` lets large batches parse in worker processes; one-shot
+    runs leave it off, since starting the workers costs more than it saves.
+    """
+    if products is None:
+        products = db.get_products()
+    admission = Admission(concurrency)
+    # A burst against one store invites WAF blocks and slow browser fallbacks.
+    hosts = HostLimiter(per_host)
+    offload = offload_parsing and len(products) >= PARSE_POOL_MIN_BATCH
+    cache = db.get_page_cache([p.id for p in products])
 
-    async def _one(pid: int) -> PollResult:
-        async with sem:
-            return await poll_product(db, pid)
+    async def _one(product: Product) -> tuple[PollResult, dict[str, Any], PageCache | None]:
+        # Store slot before the global one, as in add-search.
+        async with hosts.slot(product.source or detect_source(product.url)), admission.slot():
+            return await _poll(db, product, offload=offload, cached=cache.get(product.id))
 
-    tasks = [_one(p.id) for p in products]
-    return await asyncio.gather(*tasks)
+    polled = await asyncio.gather(*[_one(p) for p in products])
+    renames = {
+        product.id: observation["title"]
+        for product, (_, observation, _) in zip(products, polled)
+        if _needs_name(product, observation.get("title"))
+    }
+    # One transaction per cycle instead of one commit per product, run off the
+    # event loop so a slow commit (busy_timeout, fsync) does not stall it.
+    await asyncio.to_thread(
+        db.add_observations,
+        [observation for _, observation, _ in polled],
+        renames=renames,
+        page_cache=[page for _, _, page in polled if page is not None],
+    )
+    return [result for result, _, _ in polled]
 
 
-async def run_forever(db: Database, interval_s: int, concurrency: int = 6) -> None:
+def _next_interval(previous: int | None, base: int, changed: bool) -> int:
+    current = min(max(previous or base, base), base * MAX_POLL_BACKOFF)
+    if changed:
+        return max(base, current // 2)
+    return min(int(current * POLL_BACKOFF_FACTOR), base * MAX_POLL_BACKOFF)
+
+
+async def run_forever(
+    db: Database, interval_s: int, concurrency: int = 6, per_host: int = 3
+) -> None:
+    """Poll forever; stable products are polled progressively less often."""
+    last_maintenance = time.time()
     while True:
         start = time.time()
-        await poll_all(db, concurrency=concurrency)
-        elapsed = time.time() - start
-        sleep_for = max(0.0, interval_s - elapsed)
-        await asyncio.sleep(sleep_for)
+        schedule = db.get_poll_schedule()
+        due = [p for p in db.get_products() if (schedule.get(p.id, (None, None))[1] or 0) <= start]
+        if due:
+            before = db.get_latest_observations()
+            await poll_all(
+                db,
+                concurrency=concurrency,
+                per_host=per_host,
+                products=due,
+                offload_parsing=True,
+            )
+            after = db.get_latest_observations()
+            now = int(time.time())
+            updates: dict[int, tuple[int, int]] = {}
+            for p in due:
+                prev, new = before.get(p.id), after.get(p.id)
+                changed = (
+                    new is None
+                    or new.price_cents is None
+                    or prev is None
+                    or new.price_cents != prev.price_cents
+                )
+                interval = _next_interval(schedule.get(p.id, (None, None))[0], interval_s, changed)
+                updates[p.id] = (interval, now + interval)
+            db.set_poll_schedule(updates)
+            schedule.update(updates)
+        if start - last_maintenance >= MAINTENANCE_INTERVAL_S:
+            db.maintenance()
+            last_maintenance = start
+        # Wake for the next due product, but at least every interval_s so
+        # newly added products are picked up as before.
+        next_due = min((ts for _, ts in schedule.values() if ts is not None), default=None)
+        wake = start + interval_s if next_due is None else min(next_due, start + interval_s)
+        await asyncio.sleep(max(0.0, wake - time.time()))
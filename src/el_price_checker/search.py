@@ -11,6 +11,13 @@ from selectolax.parser import HTMLParser
 
 from .fetch import detect_source, fetch_html
 
+try:
+    import orjson
+except ImportError:
+    _json_loads = json.loads
+else:
+    _json_loads = orjson.loads
+
 
 @dataclass(frozen=True)
 class SearchHit:
@@ -54,17 +61,26 @@ def _parse_price_fields(offer: dict) -> tuple[int | None, str | None]:
 
 
 _RATING_RE = re.compile(r"^\d+[\.,]\d+\s*\(\d+\)")
+# morele product URLs end in "-<id>", optionally followed by "/", "?" or "#".
+_MORELE_PRODUCT_URL_RE = re.compile(r"-\d+/?(?:[#?]|$)")
+_XKOM_SLUG_RE = re.compile(r"/p/\d+-([^/]+)\.html")
+_SLUG_UPPER_RE = re.compile(r"\bpl\b|\bgb\b|\bgddr\b")
+_CARD_PRICE_RE = re.compile(r"(\d[\d\s]*[\.,]\d{2})")
+
+
+def _upper_match(m: re.Match[str]) -> str:
+    return m.group(0).upper()
 
 
 def _name_from_slug(url: str) -> str | None:
     try:
         path = urlparse(url).path
-        m = re.search(r"/p/\d+-([^/]+)\.html", path)
+        m = _XKOM_SLUG_RE.search(path)
         if not m:
             return None
         slug = m.group(1)
         slug = slug.replace("-", " ")
-        slug = re.sub(r"\bpl\b|\bgb\b|\bgddr\b", lambda m: m.group(0).upper(), slug)
+        slug = _SLUG_UPPER_RE.sub(_upper_match, slug)
         return slug.strip()
     except Exception:
         return None
@@ -120,12 +136,14 @@ def _extract_hits_from_html(html: str, base_url: str) -> list[SearchHit]:
     hits: list[SearchHit] = []
 
     # Prefer JSON-LD ItemList entries.
-    for node in doc.css('script[type="application/ld+json"]'):
+    for node in doc.tags("script"):
+        if node.attributes.get("type") != "application/ld+json":
+            continue
         raw = (node.text() or "").strip()
         if not raw:
             continue
         try:
-            data = json.loads(raw)
+            data = _json_loads(raw)
         except Exception:
             continue
         objs = data if isinstance(data, list) else [data]
@@ -139,7 +157,7 @@ def _extract_hits_from_html(html: str, base_url: str) -> list[SearchHit]:
     if hits:
         return hits
 
-    for a in doc.css("a"):
+    for a in doc.tags("a"):
         href = a.attributes.get("href")
         if not href:
             continue
@@ -148,7 +166,7 @@ def _extract_hits_from_html(html: str, base_url: str) -> list[SearchHit]:
 
         if src == "x-kom" and "/p/" not in href:
             continue
-        if src == "morele" and not re.search(r"-\d+/?(?:[#?]|$)", full_url):
+        if src == "morele" and not _MORELE_PRODUCT_URL_RE.search(full_url):
             continue
 
         title = (a.attributes.get("title") or a.text() or "").strip()
@@ -168,14 +186,7 @@ async def _search_xkom(query: str, limit: int) -> list[SearchHit]:
     url = f"https://www.x-kom.pl/szukaj?q={quote_plus(query)}"
     res = await fetch_html(url, source="x-kom")
     hits = _extract_hits_from_html(res.text, base_url="https://www.x-kom.pl")
-    hits = _filter_hits_by_query(hits, query)
-    deduped: dict[str, SearchHit] = {}
-    for hit in hits:
-        if hit.url not in deduped:
-            deduped[hit.url] = hit
-        if len(deduped) >= limit:
-            break
-    return list(deduped.values())
+    return _dedupe_hits(_filter_hits_by_query(hits, query), limit)
 
 
 async def _search_morele(query: str, limit: int) -> list[SearchHit]:
@@ -197,18 +208,11 @@ async def _search_morele(query: str, limit: int) -> list[SearchHit]:
             anchor_backup = fallback
     if not hits:
         hits = anchor_backup
-    hits = _filter_hits_by_query(hits, query)
-    deduped: dict[str, SearchHit] = {}
-    for hit in hits:
-        if hit.url not in deduped:
-            deduped[hit.url] = hit
-        if len(deduped) >= limit:
-            break
-    return list(deduped.values())
+    return _dedupe_hits(_filter_hits_by_query(hits, query), limit)
 
 
 def _parse_price(text: str) -> tuple[int | None, str | None]:
-    m = re.search(r"(\d[\d\s]*[\.,]\d{2})", text)
+    m = _CARD_PRICE_RE.search(text)
     if not m:
         return (None, None)
     raw = m.group(1).replace(" ", "").replace(",", ".")
@@ -248,6 +252,16 @@ def _extract_hits_from_morele_cards(html: str, base_url: str) -> list[SearchHit]
     return hits
 
 
+def _dedupe_hits(hits: Iterable[SearchHit], limit: int) -> list[SearchHit]:
+    """First hit per URL, in order, stopping once ``limit`` are collected."""
+    seen: dict[str, SearchHit] = {}
+    for hit in hits:
+        if len(seen) >= limit:
+            break
+        seen.setdefault(hit.url, hit)
+    return list(seen.values())
+
+
 def _filter_hits_by_query(hits: list[SearchHit], query: str) -> list[SearchHit]:
     tokens = [t.lower() for t in query.split() if t.strip()]
     if not tokens:
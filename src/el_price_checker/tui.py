@@ -57,6 +57,9 @@ class PriceTuiApp(App):
 
         self.action_refresh()
 
+    def on_unmount(self) -> None:
+        self.db.close()
+
     def action_refresh(self) -> None:
         products = self.db.get_products()
         latest = self.db.get_latest_observations()
@@ -1,21 +1,90 @@
 from __future__ import annotations
 
-import datetime
-import sqlite3
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator
+from urllib.parse import urlencode
 
+import anyio.to_thread
 from fastapi import FastAPI, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, ModuleLoader
+from platformdirs import user_cache_dir
 
-from .db import Database
-from .fetch import detect_source, fetch_html
+from . import __version__
+from .db import Database, Tag
+from .fetch import aclose, detect_source, fetch_html
 from .parse import extract_price
 from .search import search_products
 from .settings import Settings
 
+# orjson (the "speedups" extra) encodes the JSON API several times faster.
+try:
+    import orjson  # noqa: F401
+except ImportError:
+    _APIResponse: type[JSONResponse] = JSONResponse
+else:
+    _APIResponse = ORJSONResponse
+
 TEMPLATE_DIR = Path(__file__).resolve().parent / "templates"
+_TEMPLATE_NAMES = ("index.html", "product.html", "tags.html")
+# Sync handlers run on anyio's worker threads and each thread opens its own
+# SQLite connection and view cache; a small pool keeps both warm instead of
+# spreading them over anyio's default of 40 threads.
+WORKER_THREADS = 8
+# Window for the "24h change" column.
+CHANGE_WINDOW_S = 24 * 60 * 60
+
+# Templates ship with the package and never change under a running server, so
+# skip the per-render mtime check and keep compiled bytecode across restarts.
+_env = Environment(
+    loader=FileSystemLoader(str(TEMPLATE_DIR)),
+    autoescape=True,
+    auto_reload=False,
+    bytecode_cache=FileSystemBytecodeCache(),
+)
+templates = Jinja2Templates(env=_env)
+
+
+def _use_compiled_templates() -> None:
+    """Compile the templates to Python modules and load them from there.
+
+    Opt-in via ELPC_AOT_TEMPLATES=1; loading becomes a plain module import.
+    Every Uvicorn worker runs this, so each compiles into its own temporary
+    directory and publishes it with an atomic rename; importers only ever see
+    a complete directory, and losers of the race reuse the winner's.
+    """
+
+    if not isinstance(_env.loader, FileSystemLoader):
+        return  # already switched by an earlier create_app()
+    digest = hashlib.blake2b(digest_size=8)
+    for path in sorted(TEMPLATE_DIR.glob("*.html")):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    cache_dir = Path(user_cache_dir(Settings().app_name))
+    target = cache_dir / f"templates-{__version__}-{digest.hexdigest()}"
+    if not target.is_dir():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f".{target.name}-", dir=cache_dir))
+        try:
+            _env.compile_templates(str(staging), zip=None)
+            os.replace(staging, target)
+        except OSError:
+            if not target.is_dir():
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+    _env.loader = ModuleLoader(str(target))
+    _env.cache.clear()
 
 
 async def _fetch_and_parse(url: str, source: str):
@@ -24,10 +93,33 @@ async def _fetch_and_parse(url: str, source: str):
     return parsed
 
 
-def _fmt_ts(ts: int | None) -> str:
-    if ts is None:
-        return ""
-    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+def _now() -> int:
+    """Current Unix time in whole seconds (a single hook for tests)."""
+
+    return int(time.time())
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # Weak comparison (RFC 9110 8.8.3.2): the W/ prefix is ignored.
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag == "*" or tag.removeprefix("W/") == opaque
+        for tag in (t.strip() for t in header.split(","))
+    )
+
+
+def _revalidate_headers(etag: str) -> dict[str, str]:
+    # Let clients keep the page but ask again every time.
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+@lru_cache(maxsize=4096)
+def _fmt_ts(ts: int) -> str:
+    t = time.localtime(ts)
+    return "%04d-%02d-%02d %02d:%02d" % (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min)
 
 
 def create_app(db_path: Path | None = None) -> FastAPI:
@@ -35,64 +127,89 @@ def create_app(db_path: Path | None = None) -> FastAPI:
     database = Database(db_path or settings.default_db_path())
     database.init()
 
-    templates = Jinja2Templates(directory=str(TEMPLATE_DIR))
-    app = FastAPI(title="el-price-checker", docs_url=None, redoc_url=None)
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = WORKER_THREADS
+        yield
+        await aclose()
+        database.close()
+
+    if os.getenv("ELPC_AOT_TEMPLATES") == "1":
+        _use_compiled_templates()
+    for name in _TEMPLATE_NAMES:
+        _env.get_template(name)
+    app = FastAPI(title="el-price-checker", docs_url=None, redoc_url=None, lifespan=lifespan)
+
+    # Views depend on the data and, through the 24h change, on the clock; a
+    # per-thread copy is reused until either the revision or the minute moves
+    # (revision tokens are only comparable on the thread that took them). The
+    # ETag hashes the views themselves so it agrees across threads and workers.
+    views_cache = threading.local()
+
+    def _cached_views() -> tuple[tuple[dict[str, Any], ...], str]:
+        now_ts = _now()
+        key = (database.revision(), now_ts // 60)
+        cached = getattr(views_cache, "entry", None)
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+        views = tuple(_build_product_views(now_ts))
+        digest = hashlib.blake2b(f"{__version__}{views!r}".encode(), digest_size=16)
+        etag = f'W/"{digest.hexdigest()}"'
+        views_cache.entry = (key, views, etag)
+        return views, etag
 
     def _product_views() -> list[dict[str, Any]]:
-        products = database.get_products()
-        latest = database.get_latest_observations()
-        tags_map = database.get_tags_for_products([p.id for p in products])
-        now_ts = int(datetime.datetime.now().timestamp())
-        cutoff_24h = now_ts - 24 * 60 * 60
-        out: list[dict[str, Any]] = []
-        for p in products:
-            o = latest.get(p.id)
-
-            change_24h = None
-            if o and o.price_cents is not None:
-                prev = database.get_priced_observation_at_or_before(p.id, cutoff_24h)
-                if (
-                    prev
-                    and prev.price_cents is not None
-                    and (prev.currency == o.currency)
-                ):
-                    change_24h = (o.price_cents - prev.price_cents) / 100.0
-
-            out.append(
-                {
-                    "id": p.id,
-                    "name": p.name,
-                    "source": p.source,
-                    "url": p.url,
-                    "tags": [
-                        {"id": t.id, "name": t.name, "color": t.color}
-                        for t in tags_map.get(p.id, [])
-                    ],
-                    "last_price": None
-                    if not o or o.price_cents is None
-                    else o.price_cents / 100.0,
-                    "currency": "" if not o else (o.currency or ""),
-                    "last_seen": _fmt_ts(None if not o else o.ts),
-                    "error": None if not o else o.error,
-                    "change_24h": change_24h,
-                }
-            )
-        return out
+        return list(_cached_views()[0])
+
+    def _build_product_views(now_ts: int) -> list[dict[str, Any]]:
+        rows = database.get_product_dashboard(now_ts - CHANGE_WINDOW_S)
+        tags_map = database.get_tags_for_products([r.id for r in rows])
+        # Products usually share a handful of tag sets; build each set's
+        # dicts once and let those products reference the same list.
+        tag_views: dict[tuple[Tag, ...], list[dict[str, Any]]] = {}
+        for tags in tags_map.values():
+            key = tuple(tags)
+            if key not in tag_views:
+                tag_views[key] = [{"id": t.id, "name": t.name, "color": t.color} for t in tags]
+        return [
+            {
+                "id": r.id,
+                "name": r.name,
+                "source": r.source,
+                "url": r.url,
+                "tags": tag_views[tuple(tags_map[r.id])],
+                "last_price": r.last_price,
+                "currency": r.currency,
+                "last_seen": r.last_seen,
+                "error": r.error,
+                "change_24h": r.change,
+            }
+            for r in rows
+        ]
 
     @app.get("/", response_class=HTMLResponse)
-    def home(request: Request, msg: str | None = None, err: str | None = None):
-        products = _product_views()
+    def home(
+        request: Request,
+        msg: str | None = None,
+        err: str | None = None,
+        search_store: str | None = None,
+        search_query: str | None = None,
+    ):
+        products, etag = _cached_views()
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers=_revalidate_headers(etag))
         return templates.TemplateResponse(
             "index.html",
             {
                 "request": request,
-                "products": products,
+                "products": list(products),
                 "msg": msg,
                 "err": err,
-                "search_store": None,
-                "search_query": None,
+                "search_store": search_store,
+                "search_query": search_query,
                 "search_results": None,
             },
+            headers=_revalidate_headers(etag),
         )
 
     @app.get("/tags", response_class=HTMLResponse)
@@ -118,65 +235,40 @@ def create_app(db_path: Path | None = None) -> FastAPI:
     @app.post("/search", response_class=HTMLResponse)
     async def search(request: Request, store: str = Form(...), query: str = Form(...)):
         q = query.strip()
+
+        def _failed(err: str) -> RedirectResponse:
+            # Failures only need the banner and the form state; the dashboard
+            # handler rebuilds the grid from its cache.
+            params = urlencode({"err": err, "search_store": store, "search_query": q})
+            return RedirectResponse(url=f"/?{params}", status_code=303)
+
         if not q:
-            products = _product_views()
-            return templates.TemplateResponse(
-                "index.html",
-                {
-                    "request": request,
-                    "products": products,
-                    "msg": None,
-                    "err": "Search query cannot be empty",
-                    "search_store": store,
-                    "search_query": q,
-                    "search_results": [],
-                },
-            )
+            return _failed("Search query cannot be empty")
 
+        # The dashboard views are built on a worker thread while the store
+        # search is in flight. Only the search is reported as a search
+        # failure; a database error in the views propagates as itself.
+        views = asyncio.ensure_future(anyio.to_thread.run_sync(_product_views))
         try:
             hits = await search_products(store, q, limit=5)
         except ValueError as e:
-            products = _product_views()
-            return templates.TemplateResponse(
-                "index.html",
-                {
-                    "request": request,
-                    "products": products,
-                    "msg": None,
-                    "err": str(e),
-                    "search_store": store,
-                    "search_query": q,
-                    "search_results": [],
-                },
-            )
+            views.cancel()
+            return _failed(str(e))
         except Exception:
-            products = _product_views()
-            return templates.TemplateResponse(
-                "index.html",
-                {
-                    "request": request,
-                    "products": products,
-                    "msg": None,
-                    "err": "Search failed",
-                    "search_store": store,
-                    "search_query": q,
-                    "search_results": [],
-                },
-            )
-
-        results: list[dict[str, Any]] = []
-        for h in hits:
-            results.append(
-                {
-                    "name": h.name,
-                    "url": h.url,
-                    "source": h.source,
-                    "price_cents": h.price_cents,
-                    "currency": h.currency,
-                }
-            )
+            views.cancel()
+            return _failed("Search failed")
+        products = await views
 
-        products = _product_views()
+        results = [
+            {
+                "name": h.name,
+                "url": h.url,
+                "source": h.source,
+                "price_cents": h.price_cents,
+                "currency": h.currency,
+            }
+            for h in hits
+        ]
         return templates.TemplateResponse(
             "index.html",
             {
@@ -201,7 +293,7 @@ def create_app(db_path: Path | None = None) -> FastAPI:
         if count <= 0:
             return RedirectResponse(url="/?err=Nothing%20to%20add", status_code=303)
 
-        added = 0
+        items: list[dict[str, Any]] = []
         skipped = 0
         for i in range(count):
             if form.get(f"select_{i}") is None:
@@ -226,22 +318,20 @@ def create_app(db_path: Path | None = None) -> FastAPI:
                 skipped += 1
                 continue
 
-            try:
-                pid = database.add_product(name, url, source)
-            except sqlite3.IntegrityError:
-                skipped += 1
-                continue
-
-            database.add_observation(
-                pid,
-                price_cents=price_cents,
-                currency=currency,
-                in_stock=None,
-                title=None,
-                raw_price_text=None,
-                error=None,
+            items.append(
+                {
+                    "name": name,
+                    "url": url,
+                    "source": source,
+                    "price_cents": price_cents,
+                    "currency": currency,
+                }
             )
-            added += 1
+
+        # One transaction for every selected row instead of two commits each.
+        pids = database.add_products_with_observations(items)
+        added = sum(1 for pid in pids if pid is not None)
+        skipped += len(pids) - added
 
         if added == 0 and skipped > 0:
             return RedirectResponse(
@@ -259,8 +349,8 @@ def create_app(db_path: Path | None = None) -> FastAPI:
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
         latest = database.get_latest_observations().get(product_id)
-        now_ts = int(datetime.datetime.now().timestamp())
-        cutoff_24h = now_ts - 24 * 60 * 60
+        now_ts = _now()
+        cutoff_24h = now_ts - CHANGE_WINDOW_S
 
         change_24h = None
         if latest and latest.price_cents is not None:
@@ -281,7 +371,7 @@ def create_app(db_path: Path | None = None) -> FastAPI:
             if not latest or latest.price_cents is None
             else latest.price_cents / 100.0,
             "currency": "" if not latest else (latest.currency or ""),
-            "last_seen": _fmt_ts(None if not latest else latest.ts),
+            "last_seen": _fmt_ts(latest.ts) if latest else "",
             "error": None if not latest else latest.error,
             "change_24h": change_24h,
         }
@@ -295,42 +385,53 @@ def create_app(db_path: Path | None = None) -> FastAPI:
             },
         )
 
-    @app.get("/api/products")
-    def api_products():
-        return _product_views()
+    # API handlers return ready responses: the payloads are plain JSON types,
+    # so FastAPI's jsonable_encoder pass would only copy them.
+    @app.get("/api/products", response_class=_APIResponse)
+    def api_products(request: Request):
+        products, etag = _cached_views()
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers=_revalidate_headers(etag))
+        return _APIResponse(list(products), headers=_revalidate_headers(etag))
 
-    @app.get("/api/products/{product_id}/history")
+    @app.get("/api/products/{product_id}/history", response_class=_APIResponse)
     def api_history(product_id: int):
         product = database.get_product(product_id)
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
-        history = database.get_history(product_id, limit=500)
-        out: list[dict[str, Any]] = []
-        for obs in reversed(history):
-            out.append(
+        history = database.get_history_asc(product_id, limit=500)
+        return _APIResponse(
+            [
                 {
                     "ts_ms": obs.ts * 1000,
-                    "price": None
-                    if obs.price_cents is None
-                    else obs.price_cents / 100.0,
+                    "price": None if obs.price_cents is None else obs.price_cents / 100.0,
                     "currency": obs.currency,
                     "error": obs.error,
                 }
-            )
-        return out
+                for obs in history
+            ]
+        )
 
     @app.post("/add")
     async def add_product(url: str = Form(...), name: str | None = Form(None)):
         source = detect_source(url)
-        parsed = await _fetch_and_parse(url, source)
-        product_name = name or parsed.title or url
+        # Check for a duplicate while the page downloads; a known URL cancels
+        # the fetch instead of waiting it out.
+        fetch = asyncio.create_task(_fetch_and_parse(url, source))
         try:
-            pid = database.add_product(product_name, url, source)
-        except sqlite3.IntegrityError:
+            existing = await anyio.to_thread.run_sync(database.get_product_by_url, url)
+        except BaseException:
+            fetch.cancel()
+            raise
+        if existing is not None:
+            fetch.cancel()
             return RedirectResponse(url="/?err=Already%20tracking", status_code=303)
-
-        database.add_observation(
-            pid,
+        parsed = await fetch
+        product_name = name or parsed.title or url
+        pid = database.add_product_with_observation(
+            product_name,
+            url,
+            source,
             price_cents=parsed.price_cents,
             currency=parsed.currency,
             in_stock=parsed.in_stock,
@@ -338,15 +439,14 @@ def create_app(db_path: Path | None = None) -> FastAPI:
             raw_price_text=parsed.raw_price_text,
             error=parsed.error,
         )
+        if pid is None:
+            return RedirectResponse(url="/?err=Already%20tracking", status_code=303)
         return RedirectResponse(url="/?msg=Added", status_code=303)
 
     @app.post("/delete/{product_id}")
     def delete_product(product_id: int):
-        with database.connect() as conn:
-            cur = conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
-            if cur.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Product not found")
-            conn.commit()
+        if not database.delete_product(product_id):
+            raise HTTPException(status_code=404, detail="Product not found")
         return RedirectResponse(url="/?msg=Deleted", status_code=303)
 
     @app.post("/product/{product_id}/tag")
@@ -392,13 +492,9 @@ def create_app(db_path: Path | None = None) -> FastAPI:
 
     @app.post("/reorder")
     def reorder_products(order: str = Form(...)):
-        raw = [part.strip() for part in order.split(",") if part.strip()]
-        try:
-            ids = [int(x) for x in raw]
-        except ValueError:
-            return RedirectResponse(url="/?err=Invalid%20order", status_code=303)
-
+        # int() ignores surrounding whitespace; blank parts are dropped.
         try:
+            ids = list(map(int, filter(str.strip, order.split(","))))
             database.set_product_order(ids)
         except ValueError:
             return RedirectResponse(url="/?err=Invalid%20order", status_code=303)
@@ -406,3 +502,10 @@ def create_app(db_path: Path | None = None) -> FastAPI:
         return RedirectResponse(url="/?msg=Reordered", status_code=303)
 
     return app
+
+
+def create_app_factory() -> FastAPI:
+    """App factory for ``uvicorn --factory``; reads the DB path from ELPC_DB."""
+
+    db_path = os.getenv("ELPC_DB")
+    return create_app(Path(db_path) if db_path else None)
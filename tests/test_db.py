@@ -0,0 +1,505 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from el_price_checker import db as db_module
+from el_price_checker.db import SCHEMA_VERSION, Database
+
+
+def _db(tmp_path: Path) -> Database:
+    database = Database(tmp_path / "prices.sqlite3")
+    database.init()
+    return database
+
+
+def test_init_enables_wal(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    with database.connect() as conn:
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        sync = conn.execute("PRAGMA synchronous").fetchone()[0]
+    assert mode == "wal"
+    assert sync == 1  # NORMAL
+
+
+def test_init_supports_in_memory_database() -> None:
+    database = Database(Path(":memory:"))
+    database.init()
+    assert database.add_product("A", "https://example.com/a", "x-kom") == 1
+    with database.connect() as conn:
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+
+def test_add_observations_inserts_batch_and_screens_prices(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "example.com")
+    b = database.add_product("B", "https://example.com/b", "example.com")
+
+    inserted = database.add_observations(
+        [
+            {"product_id": a, "price_cents": 1000, "currency": "PLN"},
+            {"product_id": b, "price_cents": 0, "currency": "PLN"},
+            {"product_id": b, "error": "HTTP 403"},
+        ]
+    )
+
+    assert inserted == 3
+    (obs_a,) = database.get_history(a)
+    assert obs_a.price_cents == 1000
+    history_b = database.get_history(b)
+    assert len(history_b) == 2
+    assert {o.error for o in history_b} == {"Discarded non-positive price", "HTTP 403"}
+    assert all(o.price_cents is None for o in history_b)
+    assert database.add_observations([]) == 0
+
+
+def test_connect_reuses_connection_per_thread(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    assert database.connect() is database.connect()
+
+    seen: list[object] = []
+    t = threading.Thread(target=lambda: seen.append(database.connect()))
+    t.start()
+    t.join()
+    assert seen and seen[0] is not database.connect()
+
+
+def test_get_latest_observations_picks_newest_per_product(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "example.com")
+    b = database.add_product("B", "https://example.com/b", "example.com")
+    database.add_product("C", "https://example.com/c", "example.com")
+
+    database.add_observation(a, ts=100, price_cents=1000)
+    database.add_observation(a, ts=200, price_cents=1100)
+    database.add_observation(b, ts=300, price_cents=500)
+    database.add_observation(b, ts=300, price_cents=550)
+
+    latest = database.get_latest_observations()
+    assert set(latest) == {a, b}
+    assert latest[a].price_cents == 1100
+    assert latest[b].price_cents == 550
+
+
+def test_init_migrates_v1_database(tmp_path: Path) -> None:
+    database = Database(tmp_path / "prices.sqlite3")
+    with database.connect() as conn:
+        database._create_v1(conn)
+        conn.execute(
+            "INSERT INTO products(name, url, source, created_at) VALUES ('A', 'https://example.com/a', 'example.com', 0)"
+        )
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
+
+    database.init()
+
+    with database.connect() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        indexes = {
+            r[0]
+            for r in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'observations'"
+            )
+        }
+    assert version == SCHEMA_VERSION
+    assert "idx_observations_product_ts_desc" in indexes
+    assert "idx_observations_product_ts" not in indexes
+    (product,) = database.get_products()
+    assert product.display_order == product.id
+    assert database.get_all_tags() == []
+
+
+def test_iter_observations_streams_rows(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "example.com")
+    b = database.add_product("B", "https://example.com/b", "example.com")
+    database.add_observation(a, ts=100, price_cents=1000)
+    database.add_observation(b, ts=200, price_cents=2000)
+
+    rows = database.iter_observations()
+    assert not isinstance(rows, list)
+    assert [r[1] for r in rows] == [b, a]
+    assert [r[1] for r in database.iter_observations([a])] == [a]
+    assert list(database.iter_observations([])) == []
+
+
+def test_clear_removes_products_and_history_but_keeps_tags(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "example.com")
+    database.add_observation(a, price_cents=1000)
+    database.tag_product(a, "gpu", "#ff0000")
+
+    database.clear()
+
+    assert database.get_products() == []
+    assert list(database.iter_observations()) == []
+    assert [t.name for t in database.get_all_tags()] == ["gpu"]
+    with database.connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM product_tags").fetchone()[0] == 0
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+
+def test_add_product_returns_none_for_duplicate_url(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    first = database.add_product("A", "https://example.com/a", "example.com")
+    second = database.add_product("B", "https://example.com/b", "example.com")
+
+    assert first is not None and second is not None
+    assert database.add_product("A again", "https://example.com/a", "example.com") is None
+    assert [p.name for p in database.get_products()] == ["A", "B"]
+    assert [p.display_order for p in database.get_products()] == [1, 2]
+
+
+def test_add_product_with_observation_is_atomic(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    pid = database.add_product_with_observation(
+        "A", "https://example.com/a", "example.com", price_cents=1000, currency="PLN"
+    )
+
+    assert pid is not None
+    (obs,) = database.get_history(pid)
+    assert (obs.price_cents, obs.currency) == (1000, "PLN")
+    assert (
+        database.add_product_with_observation(
+            "A", "https://example.com/a", "example.com", price_cents=900
+        )
+        is None
+    )
+    assert len(database.get_history(pid)) == 1
+
+
+def test_add_products_with_observations_skips_known_urls(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    existing = database.add_product("A", "https://example.com/a", "example.com")
+
+    pids = database.add_products_with_observations(
+        [
+            {"name": "A", "url": "https://example.com/a", "source": "example.com", "price_cents": 100},
+            {"name": "B", "url": "https://example.com/b", "source": "example.com", "price_cents": 200},
+            {"name": "B dup", "url": "https://example.com/b", "source": "example.com"},
+            {"name": "C", "url": "https://example.com/c", "source": "example.com", "error": "Price not found"},
+        ]
+    )
+
+    assert pids[0] is None and pids[2] is None
+    b, c = pids[1], pids[3]
+    assert b is not None and c is not None
+    assert [p.id for p in database.get_products()] == [existing, b, c]
+    assert database.get_history(existing) == []
+    assert database.get_history(b)[0].price_cents == 200
+    assert database.get_history(c)[0].error == "Price not found"
+
+
+def test_add_observation_defaults_ts_to_now_in_sql(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    pid = database.add_product("A", "https://example.com/a", "x-kom")
+    assert pid is not None
+    before = int(time.time())
+    database.add_observation(pid, price_cents=1000)
+    database.add_observation(pid, ts=5, price_cents=1100)
+
+    history = database.get_history(pid, limit=10)
+    assert sorted(o.ts for o in history)[0] == 5
+    assert max(o.ts for o in history) >= before
+    assert database.get_product(pid).created_at >= before
+
+
+def test_add_observations_applies_renames_in_same_batch(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    pid = database.add_product("https://example.com/a", "https://example.com/a", "x-kom")
+    assert pid is not None
+
+    inserted = database.add_observations(
+        [{"product_id": pid, "price_cents": 1000, "title": "Widget"}],
+        renames={pid: "Widget"},
+    )
+
+    assert inserted == 1
+    assert database.get_product(pid).name == "Widget"
+
+
+def test_close_shuts_all_thread_connections_and_allows_reconnect(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    conns = [database.connect()]
+    worker = threading.Thread(target=lambda: conns.append(database.connect()))
+    worker.start()
+    worker.join()
+
+    database.close()
+
+    for conn in conns:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    assert database.connect() is not conns[0]
+    assert database.get_products() == []
+
+
+def test_priced_lookup_uses_partial_index(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    with database.connect() as conn:
+        plan = " ".join(
+            r[3]
+            for r in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM observations"
+                " WHERE product_id = 1 AND ts <= 5 AND price_cents IS NOT NULL"
+                " ORDER BY ts DESC LIMIT 1"
+            )
+        )
+    assert "idx_observations_priced" in plan
+
+
+def test_move_product_swaps_with_neighbour(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "x-kom")
+    b = database.add_product("B", "https://example.com/b", "x-kom")
+    c = database.add_product("C", "https://example.com/c", "x-kom")
+
+    database.move_product(c, direction="up")
+    database.move_product(a, direction="up")  # already first: no-op
+
+    assert [p.id for p in database.get_products()] == [a, c, b]
+    with database.connect() as conn:
+        assert not conn.in_transaction
+
+
+def test_init_analyzes_after_migrating(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    with database.connect() as conn:
+        stat_tables = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone()[0]
+    assert stat_tables == 1
+    database.maintenance()
+
+
+def test_latest_observations_query_never_scans_observations(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    with database.connect() as conn:
+        plan = [
+            r[3]
+            for r in conn.execute(
+                "EXPLAIN QUERY PLAN " + db_module._LATEST_OBSERVATIONS_SQL
+            )
+        ]
+    assert not any(step.startswith("SCAN o") or step.startswith("SCAN observations") for step in plan)
+    assert any("idx_observations_product_ts_desc" in step for step in plan)
+
+
+def test_get_tags_for_products_groups_by_product(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "x-kom")
+    b = database.add_product("B", "https://example.com/b", "x-kom")
+    database.tag_product(a, "gpu", "#ff0000")
+    database.tag_product(a, "amd", "#00ff00")
+
+    tags = database.get_tags_for_products([a, b])
+
+    assert [t.name for t in tags[a]] == ["amd", "gpu"]
+    assert tags[b] == []
+
+
+def test_concurrent_writers_queue_instead_of_failing(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    pid = database.add_product("A", "https://example.com/a", "x-kom")
+    errors: list[BaseException] = []
+
+    def writer(offset: int) -> None:
+        try:
+            for i in range(25):
+                database.add_observation(pid, ts=offset * 100 + i, price_cents=1000)
+                database.add_product("B", f"https://example.com/{offset}-{i}", "x-kom")
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert len(database.get_history(pid, limit=1000)) == 100
+    orders = [p.display_order for p in database.get_products()]
+    assert len(orders) == len(set(orders)) == 101
+
+
+def test_get_products_cache_tracks_local_and_external_writes(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "x-kom")
+    first = database.get_products()
+    assert database.get_products()[0] is first[0]
+
+    database.upsert_product_name(a, "Renamed")
+    assert [p.name for p in database.get_products()] == ["Renamed"]
+
+    other = Database(database.path)
+    other.add_product("B", "https://example.com/b", "x-kom")
+    assert [p.name for p in database.get_products()] == ["Renamed", "B"]
+
+
+def test_clean_price_outliers_uses_recent_median_per_product(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "x-kom")
+    b = database.add_product("B", "https://example.com/b", "x-kom")
+    # Stored before enough history existed for insert-time screening.
+    database.add_observation(a, ts=1, price_cents=100_000)
+    for ts in (2, 3, 4):
+        database.add_observation(a, ts=ts, price_cents=1000)
+    database.add_observation(b, ts=1, price_cents=100_000)
+    database.add_observation(b, ts=2, price_cents=1000)
+
+    assert database.clean_price_outliers() == 1
+    assert [o.price_cents for o in database.get_history(a)] == [1000, 1000, 1000]
+    assert len(database.get_history(b)) == 2  # too few samples to judge
+
+
+def test_upsert_tag_returns_existing_id_after_other_inserts(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    tag_id = database.upsert_tag("gpu", "#ff0000")
+    pid = database.add_product("A", "https://example.com/a", "x-kom")
+
+    assert database.upsert_tag("gpu", "#00ff00") == tag_id
+    assert database.tag_product(pid, "gpu", "#0000ff") == tag_id
+    assert [(t.id, t.color) for t in database.get_tags_for_product(pid)] == [(tag_id, "#0000FF")]
+
+
+def test_tag_attach_reports_missing_product_or_tag(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    pid = database.add_product("A", "https://example.com/a", "x-kom")
+    tag_id = database.upsert_tag("gpu", "#ff0000")
+
+    with pytest.raises(ValueError, match="Product not found"):
+        database.tag_product(pid + 1, "new", "#00ff00")
+    assert [t.name for t in database.get_all_tags()] == ["gpu"]
+    with pytest.raises(ValueError, match="Product not found"):
+        database.attach_tag(pid + 1, tag_id)
+    with pytest.raises(ValueError, match="Tag not found"):
+        database.attach_tag(pid, tag_id + 1)
+
+    assert database.attach_tag(pid, tag_id) is True
+    assert database.attach_tag(pid, tag_id) is False
+    assert [t.id for t in database.get_tags_for_product(pid)] == [tag_id]
+
+
+def test_outlier_sampling_is_index_only(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    with database.connect() as conn:
+        for sql, params in (
+            (db_module._OUTLIER_SAMPLES_SQL, (1, 50)),
+            (db_module._OUTLIER_SAMPLES_FOR_SQL, (50, "[1, 2]")),
+        ):
+            plan = " ".join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+            assert "COVERING INDEX idx_observations_priced" in plan
+
+
+def test_set_product_order_validates_permutation(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "x-kom")
+    b = database.add_product("B", "https://example.com/b", "x-kom")
+    c = database.add_product("C", "https://example.com/c", "x-kom")
+
+    database.set_product_order([c, a, b])
+    assert [p.id for p in database.get_products()] == [c, a, b]
+
+    for bad in ([c, a], [c, a, a], [c, a, b + 10]):
+        with pytest.raises(ValueError):
+            database.set_product_order(bad)
+    assert [p.id for p in database.get_products()] == [c, a, b]
+
+
+def test_get_product_and_tags_cache_follow_writes(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    pid = database.add_product("A", "https://example.com/a", "x-kom")
+    assert database.get_product(pid) is database.get_product(pid)
+    assert database.get_product(pid + 1) is None
+
+    database.upsert_product_name(pid, "Renamed")
+    assert database.get_product(pid).name == "Renamed"
+
+    assert database.get_all_tags() == []
+    Database(database.path).upsert_tag("Sale", "#ff0000")
+    assert [t.name for t in database.get_all_tags()] == ["Sale"]
+
+
+def test_init_skips_outlier_sweep_until_interval_elapsed(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    pid = database.add_product("A", "https://example.com/a", "x-kom")
+    database.add_observation(pid, ts=1, price_cents=100_000)
+    for ts in (2, 3, 4):
+        database.add_observation(pid, ts=ts, price_cents=1000)
+
+    database.init()
+    assert len(database.get_history(pid)) == 4  # swept moments ago by _db()
+
+    with database.connect() as conn:
+        conn.execute(
+            "UPDATE meta SET value = value - ? WHERE key = 'last_clean'",
+            (db_module.CLEAN_INTERVAL_S,),
+        )
+    database.init()
+    assert len(database.get_history(pid)) == 3
+
+
+def test_delete_product_cascades_and_reports_missing(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "example.com")
+    database.add_observation(a, price_cents=1000)
+    database.tag_product(a, "gpu", "#ff0000")
+
+    assert database.delete_product(a) is True
+    assert database.delete_product(a) is False
+    assert database.get_products() == []
+    assert list(database.iter_observations()) == []
+    assert database.get_tags_for_products([a]) == {a: []}
+
+
+def test_get_history_asc_keeps_newest_window_oldest_first(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    pid = database.add_product("A", "https://example.com/a", "example.com")
+    for ts in (30, 10, 40, 20):
+        database.add_observation(pid, ts=ts, price_cents=1000)
+
+    assert [o.ts for o in database.get_history_asc(pid, limit=3)] == [20, 30, 40]
+    assert [o.ts for o in database.get_history(pid, limit=3)] == [40, 30, 20]
+
+
+def test_get_product_by_url(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    pid = database.add_product("A", "https://example.com/a", "example.com")
+
+    assert database.get_product_by_url("https://example.com/a").id == pid
+    assert database.get_product_by_url("https://example.com/b") is None
+
+
+def test_get_product_dashboard_projects_latest_observation(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    a = database.add_product("A", "https://example.com/a", "x-kom")
+    b = database.add_product("B", "https://example.com/b", "x-kom")
+    database.add_observation(a, ts=100, price_cents=1000, currency="PLN")
+    database.add_observation(a, ts=200, price_cents=1250, currency="PLN")
+
+    row_a, row_b = database.get_product_dashboard(150)
+    assert (row_a.id, row_a.price_cents, row_a.last_price, row_a.currency) == (a, 1250, 12.5, "PLN")
+    assert row_a.last_seen == time.strftime("%Y-%m-%d %H:%M", time.localtime(200))
+    assert row_a.change == 2.5
+    assert (row_b.id, row_b.last_price, row_b.currency, row_b.last_seen) == (b, None, "", "")
+    assert row_b.change is None
+
+    # No priced observation before the cutoff, or one in another currency.
+    assert database.get_product_dashboard(50)[0].change is None
+    database.add_observation(a, ts=300, price_cents=300, currency="EUR")
+    assert database.get_product_dashboard(250)[0].change is None
+
+
+def test_dashboard_query_never_scans_observations(tmp_path: Path) -> None:
+    database = _db(tmp_path)
+    with database.connect() as conn:
+        plan = [
+            r[3]
+            for r in conn.execute("EXPLAIN QUERY PLAN " + db_module._DASHBOARD_SQL, {"cutoff": 0})
+        ]
+    assert not any(step.startswith("SCAN o") or step.startswith("SCAN observations") for step in plan)
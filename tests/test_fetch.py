@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import httpx
+import pytest
+
+from el_price_checker import fetch
+
+
+@pytest.mark.asyncio
+async def test_clients_are_reused_per_source_until_aclose() -> None:
+    client = fetch._get_client("x-kom")
+    assert fetch._get_client("x-kom") is client
+    assert fetch._get_client("morele") is not client
+
+    await fetch.aclose()
+    assert client.is_closed
+    assert fetch._get_client("x-kom") is not client
+    await fetch.aclose()
+
+
+def test_headers_for_source_returns_fresh_copies() -> None:
+    headers = fetch._headers_for_source("x-kom")
+    assert headers == fetch._build_headers("x-kom")
+    headers["referer"] = "changed"
+    assert fetch._headers_for_source("x-kom")["referer"] == "https://www.x-kom.pl/"
+    assert fetch._headers_for_source("example.com") == fetch._build_headers("example.com")
+
+
+def test_looks_like_block_ignores_case() -> None:
+    assert fetch._looks_like_block("<h1>Access Denied – spróbuj ponownie</h1>".encode())
+    assert not fetch._looks_like_block("<p>Karta graficzna 3 339,00 zł</p>".encode())
+
+
+def test_is_markup_by_content_type() -> None:
+    def resp(content_type: str | None) -> httpx.Response:
+        headers = {} if content_type is None else {"content-type": content_type}
+        return httpx.Response(200, headers=headers)
+
+    assert fetch._is_markup(resp("text/html; charset=utf-8"))
+    assert fetch._is_markup(resp("application/xhtml+xml"))
+    assert fetch._is_markup(resp(None))
+    assert not fetch._is_markup(resp("image/webp"))
+    assert not fetch._is_markup(resp("application/pdf"))
+
+
+def test_looks_like_block_only_scans_page_head() -> None:
+    filler = b"<p>" + b"x" * fetch.BLOCK_SCAN_BYTES + b"</p>"
+    assert not fetch._looks_like_block(filler + b"<script>cloudflare insights</script>")
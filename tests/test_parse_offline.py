@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from el_price_checker.parse import extract_price
+from el_price_checker.parse import _num_to_cents, extract_price
 
 
 def test_parse_xkom_like_html_extracts_price_pln() -> None:
@@ -55,3 +55,56 @@ def test_parse_amazon_like_html_extracts_price() -> None:
     assert parsed.error is None
     assert parsed.currency == "EUR"
     assert parsed.price_cents == 19999
+
+
+def test_parse_meta_price_tags() -> None:
+    html = """
+    <html><head>
+      <meta property="og:title" content="Monitor ABC" />
+      <meta property="product:price:amount" content="1 299,00" />
+      <meta property="product:price:currency" content="PLN" />
+      <meta property="product:price:amount" content="1.00" />
+    </head><body><h1>Other</h1></body></html>
+    """
+    parsed = extract_price(html)
+    assert parsed.title == "Monitor ABC"
+    assert parsed.currency == "PLN"
+    assert parsed.price_cents == 129900
+
+
+def test_parse_reports_amazon_captcha_page() -> None:
+    html = "<html><head><title>Amazon.pl</title></head><body>Enter the CAPTCHA – zł</body></html>"
+    parsed = extract_price(html)
+    assert parsed.error == "Blocked by anti-bot / CAPTCHA"
+    assert parsed.title == "Amazon.pl"
+
+
+def test_parse_finds_first_priced_offer_in_jsonld_graph() -> None:
+    html = """
+    <html><head><script type="application/ld+json">
+      {"@graph": [
+        {"@type": "BreadcrumbList", "itemListElement": [{"name": "GPU"}]},
+        {"@type": "Product", "offers": {"@type": "Offer", "availability": "InStock"}},
+        {"@type": "Product", "offers": [{"price": 1499.5, "priceCurrency": "PLN"}]},
+        {"@type": "Product", "offers": {"price": "1.00", "priceCurrency": "PLN"}}
+      ]}
+    </script></head><body></body></html>
+    """
+    parsed = extract_price(html)
+    assert parsed.price_cents == 149950
+    assert parsed.currency == "PLN"
+
+
+def test_numeric_jsonld_prices_round_like_their_text() -> None:
+    assert _num_to_cents(2.675) == 268  # the double is 2.67499999...
+    assert _num_to_cents(1499.5) == 149950
+    assert _num_to_cents(12) == 1200
+    assert _num_to_cents(True) is None
+    assert _num_to_cents(float("nan")) is None
+
+
+def test_extract_price_reuses_result_for_identical_html() -> None:
+    html = "<html><head><title>Cached</title></head><body>12,34 zł</body></html>"
+    first = extract_price(html)
+    assert extract_price(html) is first
+    assert extract_price(html + " ").price_cents == first.price_cents
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from pathlib import Path
+
+import pytest
+
+from el_price_checker import runner
+from el_price_checker.db import Database
+from el_price_checker.fetch import FetchResult
+from el_price_checker.runner import Admission, HostLimiter
+
+
+@pytest.mark.asyncio
+async def test_admission_bounds_and_resizes_concurrency() -> None:
+    admission = Admission(2)
+    active = 0
+    peak = 0
+    release = asyncio.Event()
+
+    async def work() -> None:
+        nonlocal active, peak
+        async with admission.slot():
+            active += 1
+            peak = max(peak, active)
+            await release.wait()
+            active -= 1
+
+    tasks = [asyncio.create_task(work()) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert active == 2
+
+    await admission.resize(4)
+    await asyncio.sleep(0)
+    assert active == 4
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert peak == 4
+    assert admission.limit == 4
+
+
+@pytest.mark.asyncio
+async def test_host_limiter_caps_each_source_independently() -> None:
+    hosts = HostLimiter(1)
+    active: dict[str, int] = {"a": 0, "b": 0}
+    peak: dict[str, int] = {"a": 0, "b": 0}
+
+    async def work(source: str) -> None:
+        async with hosts.slot(source):
+            active[source] += 1
+            peak[source] = max(peak[source], active[source])
+            await asyncio.sleep(0)
+            active[source] -= 1
+
+    await asyncio.gather(*[work(s) for s in ("a", "b", "a", "b", "a")])
+    assert peak == {"a": 1, "b": 1}
+
+
+@pytest.mark.asyncio
+async def test_poll_all_caps_concurrency_per_store(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    db = Database(tmp_path / "prices.sqlite3")
+    db.init()
+    for i in range(4):
+        db.add_product(f"A{i}", f"https://www.x-kom.pl/p/{i}-a.html", "x-kom")
+        db.add_product(f"B{i}", f"https://www.morele.net/b-{i}/", "morele")
+
+    active: dict[str, int] = {"x-kom": 0, "morele": 0}
+    peak: dict[str, int] = {"x-kom": 0, "morele": 0}
+
+    async def fake_fetch(url: str, source: str | None = None, **_: object) -> FetchResult:
+        assert source is not None
+        active[source] += 1
+        peak[source] = max(peak[source], active[source])
+        await asyncio.sleep(0.01)
+        active[source] -= 1
+        return FetchResult(url, url, 200, "<p>10,00 zł</p>")
+
+    monkeypatch.setattr(runner, "fetch_html", fake_fetch)
+    monkeypatch.setattr(runner, "PARSE_POOL_MIN_BATCH", 100)
+    results = await runner.poll_all(db, concurrency=6, per_host=2)
+    assert all(r.ok for r in results)
+    assert peak == {"x-kom": 2, "morele": 2}
+
+
+@pytest.mark.asyncio
+async def test_poll_all_reuses_cached_parse_on_304(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    db = Database(tmp_path / "prices.sqlite3")
+    db.init()
+    pid = db.add_product("A", "https://www.x-kom.pl/p/1-a.html", "x-kom")
+    seen: list[str | None] = []
+
+    async def fake_fetch(url: str, etag: str | None = None, **_: object) -> FetchResult:
+        seen.append(etag)
+        if etag == '"v1"':
+            return FetchResult(url, url, 304, "")
+        return FetchResult(url, url, 200, "<p>10,00 zł</p>", etag='"v1"')
+
+    monkeypatch.setattr(runner, "fetch_html", fake_fetch)
+    await runner.poll_all(db)
+    results = await runner.poll_all(db)
+
+    assert seen == [None, '"v1"']
+    assert results[0].ok
+    assert [o.price_cents for o in db.get_history(pid)] == [1000, 1000]
+
+
+def test_next_interval_backs_off_and_recovers() -> None:
+    assert runner._next_interval(None, 60, changed=False) == 90
+    assert runner._next_interval(90, 60, changed=False) == 135
+    assert runner._next_interval(400, 60, changed=False) == 480  # capped at 8x
+    assert runner._next_interval(480, 60, changed=True) == 240
+    assert runner._next_interval(90, 60, changed=True) == 60
+
+
+@pytest.mark.asyncio
+async def test_run_forever_schedules_unchanged_products_later(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    db = Database(tmp_path / "prices.sqlite3")
+    db.init()
+    pid = db.add_product("A", "https://www.x-kom.pl/p/1-a.html", "x-kom")
+    db.add_observation(pid, price_cents=1000)
+
+    async def fake_fetch(url: str, **_: object) -> FetchResult:
+        return FetchResult(url, url, 200, "<p>10,00 zł</p>")
+
+    monkeypatch.setattr(runner, "fetch_html", fake_fetch)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(runner.run_forever(db, interval_s=600), timeout=0.5)
+
+    interval, next_ts = db.get_poll_schedule()[pid]
+    assert interval == 900
+    assert next_ts is not None and next_ts > time.time() + 800
+
+
+@pytest.mark.asyncio
+async def test_offloaded_parse_is_remembered_in_this_process(monkeypatch) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    submitted: list[str] = []
+
+    class RecordingPool(ThreadPoolExecutor):
+        def submit(self, fn, /, *args, **kwargs):
+            submitted.append(args[0])
+            return super().submit(fn, *args, **kwargs)
+
+    with RecordingPool(1) as pool:
+        monkeypatch.setattr(runner, "_parse_pool", lambda: pool)
+        html = "<html><head><title>Offloaded</title></head><body>7,50 zł</body></html>"
+        first = await runner._extract(html, offload=True)
+        second = await runner._extract(html, offload=True)
+
+    assert submitted == [html]
+    assert second is first
+    assert first.price_cents == 750
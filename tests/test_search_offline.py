@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+from el_price_checker.search import SearchHit, _dedupe_hits, _extract_hits_from_html
+
+
+def test_extract_hits_prefers_jsonld_itemlist() -> None:
+    html = """
+    <script type="application/ld+json">
+      {"@type": "ItemList", "itemListElement": [
+        {"item": {"url": "/p/1-karta-a.html", "name": "Karta A", "offers": {"price": "1299.00", "priceCurrency": "PLN"}}}
+      ]}
+    </script>
+    <a href="/p/9-karta-z.html">Z</a>
+    """
+    hits = _extract_hits_from_html(html, base_url="https://www.x-kom.pl")
+    assert [(h.name, h.url, h.price_cents) for h in hits] == [
+        ("Karta A", "https://www.x-kom.pl/p/1-karta-a.html", 129900)
+    ]
+
+
+def test_extract_hits_falls_back_to_product_anchors() -> None:
+    html = """
+    <a href="/p/123-karta-rtx.html">RTX</a>
+    <a href="/c/5-karty.html">Kategoria</a>
+    <a href="https://www.morele.net/karta-x-14731776/">Morele</a>
+    <a href="https://www.morele.net/kategoria/">Kategoria</a>
+    <a>no link</a>
+    """
+    hits = _extract_hits_from_html(html, base_url="https://www.x-kom.pl")
+    assert [(h.source, h.url) for h in hits] == [
+        ("x-kom", "https://www.x-kom.pl/p/123-karta-rtx.html"),
+        ("morele", "https://www.morele.net/karta-x-14731776/"),
+    ]
+
+
+def test_dedupe_hits_keeps_first_per_url_up_to_limit() -> None:
+    hits = [SearchHit(str(i), url, None, None, "x-kom") for i, url in enumerate("aabcbd")]
+    assert [(h.name, h.url) for h in _dedupe_hits(hits, 3)] == [("0", "a"), ("2", "b"), ("3", "c")]
+    assert len(_dedupe_hits(hits, 10)) == 4